@@ -0,0 +1,362 @@
+import json
+import os
+import re
+import numpy as np
+
+from create_ground_truth import parse_stance
+from label_store import CODES, LABELS, read_table
+
+# Codes are those of label_store (0..2 for -1, 0, 1 and 3 for anything
+# else); a rating that is not there at all is MISSING
+K = len(LABELS) + 1
+MISSING = -1
+
+TOPIC_FIELD = re.compile(r"stance-on-topic-(\d+)$")
+
+
+def _group_sum(values, index, size):
+    """
+    Sum the rows of values (n × columns) that share an index, for indices 0..size-1.
+    """
+    return np.stack(
+        [np.bincount(index, weights=values[:, c], minlength=size) for c in range(values.shape[1])], axis=1
+    )
+
+
+def _batched(statistic):
+    """
+    Let a statistic of (units × raters, groups, n_groups) also take a stack of
+    rating matrices with any number of leading axes, e.g. bootstrap resamples.
+    """
+    def wrapper(ratings, groups, n_groups):
+        ratings = np.asarray(ratings)
+        lead = ratings.shape[:-2]
+        batch = int(np.prod(lead, dtype=int))
+
+        flat = ratings.reshape(-1, ratings.shape[-1])
+        index = (np.arange(batch)[:, None] * n_groups + np.asarray(groups)[None, :]).ravel()
+
+        return statistic(flat, index, batch * n_groups).reshape(*lead, n_groups)
+
+    wrapper.__name__ = statistic.__name__
+    wrapper.__doc__ = statistic.__doc__
+    return wrapper
+
+
+def category_counts(ratings):
+    """
+    Number of raters that chose every category, per unit (units × K).
+    """
+    ratings = np.asarray(ratings)
+    units = np.broadcast_to(np.arange(len(ratings))[:, None], ratings.shape)
+    present = ratings != MISSING
+
+    cells = units[present] * K + ratings[present]
+    return np.bincount(cells, minlength=len(ratings) * K).reshape(len(ratings), K)
+
+
+def kappa_from_confusion(conf):
+    """
+    Cohen's kappa of confusion counts (..., K, K), computed like scikit-learn's
+    cohen_kappa_score (NaN when both raters used a single, identical label).
+    """
+    conf = np.asarray(conf, dtype=float)
+    n = conf.sum(axis=(-2, -1))
+    disagree = 1 - np.eye(K)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = conf.sum(axis=-1)[..., :, None] * conf.sum(axis=-2)[..., None, :] / n[..., None, None]
+        return 1 - (disagree * conf).sum(axis=(-2, -1)) / (disagree * expected).sum(axis=(-2, -1))
+
+
+@_batched
+def cohen_kappa(ratings, index, size):
+    """
+    Cohen's kappa between the two rater columns of every group; units that
+    one of them did not rate are left out.
+    """
+    if ratings.shape[1] != 2:
+        raise ValueError("Cohen's kappa needs exactly two annotators; use Fleiss' kappa or Krippendorff's alpha")
+
+    complete = (ratings != MISSING).all(axis=1)
+    cells = (index * K + ratings[:, 0]) * K + ratings[:, 1]
+    conf = np.bincount(cells[complete], minlength=size * K * K).reshape(size, K, K)
+
+    return kappa_from_confusion(conf)
+
+
+@_batched
+def fleiss_kappa(ratings, index, size):
+    """
+    Fleiss' kappa of every group. Units may have a different number of
+    ratings; units with fewer than two are left out.
+    """
+    counts = category_counts(ratings).astype(float)
+    m = counts.sum(axis=1)
+    pairable = m >= 2
+    counts, m, index = counts[pairable], m[pairable], index[pairable]
+
+    # Share of agreeing rater pairs per unit
+    agreement = ((counts ** 2).sum(axis=1) - m) / (m * (m - 1))
+
+    sums = _group_sum(np.column_stack([agreement, m, np.ones_like(m), counts]), index, size)
+    p_bar = sums[:, 0] / sums[:, 2]
+    p_cat = sums[:, 3:] / sums[:, 1:2]
+    p_e = (p_cat ** 2).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (p_bar - p_e) / (1 - p_e)
+
+
+@_batched
+def krippendorff_alpha(ratings, index, size):
+    """
+    Krippendorff's alpha (nominal) of every group, from the coincidence matrix
+    of all pairable units. Missing ratings are allowed.
+    """
+    present = ratings != MISSING
+    m = present.sum(axis=1)
+    coincidence = np.zeros(size * K * K)
+
+    # Every ordered pair of ratings of a unit adds 1 / (m - 1) to its cell
+    for i in range(ratings.shape[1]):
+        for j in range(ratings.shape[1]):
+            if i == j:
+                continue
+            pair = present[:, i] & present[:, j]
+            cells = (index[pair] * K + ratings[pair, i]) * K + ratings[pair, j]
+            coincidence += np.bincount(cells, weights=1 / (m[pair] - 1), minlength=size * K * K)
+
+    coincidence = coincidence.reshape(size, K, K)
+
+    n_c = coincidence.sum(axis=2)
+    n = n_c.sum(axis=1)
+    observed = coincidence.sum(axis=(1, 2)) - np.trace(coincidence, axis1=1, axis2=2)
+    expected = n ** 2 - (n_c ** 2).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 - (n - 1) * observed / expected
+
+
+STATISTICS = {
+    "cohen": cohen_kappa,
+    "fleiss": fleiss_kappa,
+    "alpha": krippendorff_alpha,
+}
+
+
+def speaker_units(tables):
+    """
+    Stack the speaker × topic tables of several annotators of one hearing
+    into (topics · speakers) × annotators ratings, grouped by topic.
+    """
+    first = tables[0]
+    for table in tables[1:]:
+        if table["speakers"] != first["speakers"] or table["topics"] != first["topics"]:
+            raise ValueError("Annotator tables must have identical speakers and topics.")
+
+    labels = np.stack([t["labels"] for t in tables], axis=-1).transpose(1, 0, 2)
+    groups = np.repeat(np.arange(len(first["topics"])), len(first["speakers"]))
+
+    return labels.reshape(-1, len(tables)).astype(np.int8), groups, first["topics"]
+
+
+def segment_stances(task, annotation, n_topics):
+    """
+    Stance codes of one annotation of a Label Studio task, by topic.
+    """
+    stances = np.full(n_topics, MISSING, dtype=np.int8)
+    position = 0
+
+    for res in annotation["result"]:
+        if "choices" not in res["value"]:
+            continue
+
+        match = TOPIC_FIELD.match(res.get("from_name", ""))
+        t = int(match.group(1)) - 1 if match else position
+        position += 1
+
+        if 0 <= t < n_topics:
+            stances[t] = CODES[str(parse_stance(res["value"]["choices"][0]))]
+
+    return stances
+
+
+def segment_units(exports, n_topics):
+    """
+    Ratings of every segment and topic from several Label Studio exports, as
+    (topics · segments) × annotators, grouped by topic. Every annotator
+    (export and user) is a column; segments they did not label are MISSING.
+    """
+    ratings = {}    # (export, annotator) → {segment id: stances}
+
+    for e, tasks in enumerate(exports):
+        for task in tasks:
+            for annotation in task["annotations"]:
+                if annotation.get("was_cancelled"):
+                    continue
+                # Every export is its own Label Studio project with its own task ids, so
+                # segments are matched by the id they got from parse_hearing.py
+                segment = task["data"].get("id", task["id"])
+                rater = (e, annotation.get("completed_by"))
+                ratings.setdefault(rater, {})[segment] = segment_stances(task, annotation, n_topics)
+
+    raters = sorted(ratings, key=str)
+    segments = sorted({s for by_segment in ratings.values() for s in by_segment})
+
+    units = np.full((n_topics, len(segments), len(raters)), MISSING, dtype=np.int8)
+    for r, rater in enumerate(raters):
+        for i, segment in enumerate(segments):
+            if segment in ratings[rater]:
+                units[:, i, r] = ratings[rater][segment]
+
+    groups = np.repeat(np.arange(n_topics), len(segments))
+    return units.reshape(-1, len(raters)), groups
+
+
+def annotator_files(path, prefix, suffix):
+    """
+    Files <prefix><n><suffix> of a hearing, ordered by n.
+    """
+    pattern = re.compile(rf"{re.escape(prefix)}(\d+){re.escape(suffix)}$")
+    found = [(int(m.group(1)), f) for f in os.listdir(path) if (m := pattern.match(f))]
+    return [os.path.join(path, f) for _, f in sorted(found)]
+
+
+def hearing_units(path, level="speaker"):
+    """
+    Ratings, topic groups and topic names of one hearing: speaker level from
+    ground_truth_<n>.csv, segment level from annotations_<n>.json.
+    Returns None when the hearing has fewer than two annotators.
+    """
+    if level == "speaker":
+        files = annotator_files(path, "ground_truth_", ".csv")
+        if len(files) < 2:
+            return None
+        return speaker_units([read_table(f) for f in files])
+
+    files = annotator_files(path, "annotations_", ".json")
+    if not files:
+        return None
+
+    if os.path.isfile(f"{path}/topics.txt"):
+        with open(f"{path}/topics.txt", "r", encoding="utf-8") as f:
+            topics = [line.strip() for line in f if line.strip()]
+    else:
+        topics = read_table(f"{path}/ground_truth.csv")["topics"]
+
+    exports = []
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            exports.append(json.load(f))
+
+    ratings, groups = segment_units(exports, len(topics))
+    if ratings.shape[1] < 2:
+        return None
+    return ratings, groups, topics
+
+
+def corpus_units(base_dir="hearings", hearings=None, level="speaker"):
+    """
+    Ratings of all hearings in one array, with one group per hearing and topic.
+    Hearings with fewer annotators than the most are padded with MISSING.
+    Returns (ratings, groups, names) with names[g] = (hearing, topic).
+    """
+    hearings = hearings or sorted(h for h in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, h)))
+    parts, names = [], []
+
+    for hearing in hearings:
+        units = hearing_units(os.path.join(base_dir, hearing), level)
+        if units is None:
+            continue
+
+        ratings, groups, topics = units
+        parts.append((ratings, groups + len(names)))
+        names.extend((hearing, topic) for topic in topics)
+
+    if not parts:
+        return np.zeros((0, 2), dtype=np.int8), np.zeros(0, dtype=int), []
+
+    n_raters = max(r.shape[1] for r, _ in parts)
+    ratings = np.concatenate([
+        np.pad(r, ((0, 0), (0, n_raters - r.shape[1])), constant_values=MISSING) for r, _ in parts
+    ])
+    groups = np.concatenate([g for _, g in parts])
+
+    return ratings, groups, names
+
+
+def bootstrap(ratings, groups, n_groups, statistic, n_iter=1000, seed=0, chunk_size=100):
+    """
+    Bootstrap distribution (n_iter × n_groups) of a statistic, resampling the
+    units of every group with replacement.
+    """
+    rng = np.random.default_rng(seed)
+
+    order = np.argsort(groups, kind="stable")
+    ratings, groups = ratings[order], groups[order]
+    sizes = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    chunks = []
+    for start in range(0, n_iter, chunk_size):
+        n = min(chunk_size, n_iter - start)
+        idx = starts[groups] + rng.integers(0, sizes[groups], size=(n, len(groups)))
+        chunks.append(statistic(ratings[idx], groups, n_groups))
+
+    return np.concatenate(chunks)
+
+
+def summarize(values, names):
+    """
+    Per-topic values, hearing averages and the corpus average (the mean of
+    the hearing averages). values has the groups on its last axis.
+    """
+    hearings = list(dict.fromkeys(h for h, _ in names))
+    hearing_of = np.array([hearings.index(h) for h, _ in names])
+
+    averages = np.stack([values[..., hearing_of == i].mean(axis=-1) for i in range(len(hearings))], axis=-1)
+    return hearings, averages, averages.mean(axis=-1)
+
+
+def corpus_agreement(base_dir="hearings", hearings=None, level="speaker", metric="cohen", n_boot=0, seed=0,
+                     confidence=0.95):
+    """
+    Agreement of every topic of every hearing in one pass, with hearing and
+    corpus averages and, if n_boot > 0, percentile bootstrap intervals.
+    """
+    ratings, groups, names = corpus_units(base_dir, hearings, level)
+    statistic = STATISTICS[metric]
+
+    values = statistic(ratings, groups, len(names))
+    hearing_names, averages, overall = summarize(values, names)
+
+    results = {
+        "level": level,
+        "metric": metric,
+        "hearings": {
+            hearing: {
+                "per_topic": {t: float(v) for (h, t), v in zip(names, values) if h == hearing},
+                "average": float(average),
+            }
+            for hearing, average in zip(hearing_names, averages)
+        },
+        "average": float(overall) if names else None,
+    }
+
+    if n_boot and names:
+        boot = bootstrap(ratings, groups, len(names), statistic, n_boot, seed)
+        _, boot_averages, boot_overall = summarize(boot, names)
+
+        alpha = (1 - confidence) / 2
+        quantiles = [alpha, 1 - alpha]
+        topic_ci = np.nanquantile(boot, quantiles, axis=0)
+        hearing_ci = np.nanquantile(boot_averages, quantiles, axis=0)
+
+        for i, hearing in enumerate(hearing_names):
+            results["hearings"][hearing]["ci"] = hearing_ci[:, i].tolist()
+        for g, (hearing, topic) in enumerate(names):
+            results["hearings"][hearing].setdefault("per_topic_ci", {})[topic] = topic_ci[:, g].tolist()
+        results["ci"] = np.nanquantile(boot_overall, quantiles).tolist()
+
+    return results
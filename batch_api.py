@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import sys
+
+import llm_cache
+from call_chatgpt import write_output
+from create_prompt import LAYOUTS
+from run_grid import MODELS, PROMPTS, load_prompt, plan_grid
+
+ENDPOINT = "/v1/responses"
+
+
+def custom_id(hearing, model, prompt):
+    return f"{hearing}/{model}/{prompt}"
+
+
+def parse_custom_id(cid):
+    # Hearings and prompt names never contain "/", but model ids may
+    hearing, rest = cid.split("/", 1)
+    model, prompt = rest.rsplit("/", 1)
+    return hearing, model, prompt
+
+
+def export_requests(cells, output, base_dir="hearings", build=False, layout="classic"):
+    """
+    Write one Batch API request per cell. The custom_id only depends on the
+    cell, so results can always be traced back to their output CSV.
+    """
+    with open(output, "w", encoding="utf-8") as f:
+        for hearing, model, prompt_name in cells:
+            prompt = load_prompt(base_dir, hearing, prompt_name, build, layout)
+
+            request = {
+                "custom_id": custom_id(hearing, model, prompt_name),
+                "method": "POST",
+                "url": ENDPOINT,
+                "body": {"model": model, "input": prompt},
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+def output_text(body: dict) -> str:
+    """
+    Concatenate the text parts of a raw Responses API body, which is what
+    `response.output_text` does in the SDK.
+    """
+    texts = []
+
+    for item in body.get("output", []):
+        if item.get("type") != "message":
+            continue
+        for content in item.get("content", []):
+            if content.get("type") == "output_text":
+                texts.append(content["text"])
+
+    return "".join(texts)
+
+
+def read_request_bodies(path):
+    bodies = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                request = json.loads(line)
+                bodies[request["custom_id"]] = request["body"]
+
+    return bodies
+
+
+def ingest_results(results, base_dir="hearings", requests=None):
+    """
+    Fan a Batch API results file back out into the output CSVs. When the
+    matching requests file is given, every answer is also added to the cache.
+    Returns the custom_ids that failed.
+    """
+    bodies = read_request_bodies(requests) if requests else {}
+    failed = []
+
+    with open(results, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+            cid = result["custom_id"]
+            response = result.get("response") or {}
+
+            if result.get("error") or response.get("status_code") != 200:
+                print(f"⨉ {cid} failed: {result.get('error') or response.get('status_code')}")
+                failed.append(cid)
+                continue
+
+            hearing, model, prompt_name = parse_custom_id(cid)
+            body = response["body"]
+
+            record = {
+                "model": model,
+                "params": {},
+                "output_text": output_text(body),
+                "response": body,
+            }
+
+            if cid in bodies:
+                llm_cache.store(llm_cache.cache_key(model, bodies[cid]["input"]), record)
+
+            output_path = f"{base_dir}/{hearing}/output/{model}"
+            os.makedirs(output_path, exist_ok=True)
+            write_output(output_path, prompt_name, record)
+
+            print(f"✓ Wrote response to {output_path}/{prompt_name}.csv")
+
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Export and ingest OpenAI Batch API files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a request JSONL for every pending call")
+    export_parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    export_parser.add_argument('-m', '--models', nargs='+', default=MODELS)
+    export_parser.add_argument('-p', '--prompts', nargs='+', default=PROMPTS, choices=PROMPTS)
+    export_parser.add_argument('-a', '--all', action='store_true', help="Also export cells that already have an output")
+    export_parser.add_argument('--build', action='store_true', help="Compile prompts in memory instead of reading prompts/")
+    export_parser.add_argument('-l', '--layout', default="classic", choices=LAYOUTS, help="Prompt layout used with --build")
+    export_parser.add_argument('-o', '--output', default="batch_requests.jsonl")
+
+    ingest_parser = subparsers.add_parser("ingest", help="Write a results JSONL into the output CSVs")
+    ingest_parser.add_argument('results')
+    ingest_parser.add_argument('-r', '--requests', default="batch_requests.jsonl",
+                               help="Requests file the results belong to, used to fill the cache")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+
+    if args.command == "export":
+        cells = plan_grid(base_dir, args.hearings, args.models, args.prompts, skip_existing=not args.all, build=args.build)
+        export_requests(cells, args.output, base_dir, args.build, args.layout)
+        print(f"✓ Exported {len(cells)} requests ({args.output})")
+
+    else:
+        requests = args.requests if os.path.isfile(args.requests) else None
+        failed = ingest_results(args.results, base_dir, requests)
+
+        if failed:
+            sys.exit(1)
@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+
+import agreement
+import bootstrap
+import evaluation
+from create_ground_truth import (aggregate_stances, create_ground_truth_table, ingest_annotations, iter_export,
+                                 parse_annotations, parse_txt_to_list, write_ground_truth)
+from create_prompt import SECTIONS, iter_prompt, load_components, load_hearing
+from evaluate_all_hearings import MODELS, PROMPT_FILES
+from find_differences import create_ground_truth
+from parse_hearing import iter_segments
+
+STANCES = {-1: "Negative", 0: "Neutral", 1: "Positive"}
+
+SYLLABLES = ["ba", "den", "fal", "ker", "lon", "mar", "nis", "ro", "sta", "tul", "ve", "wick"]
+TITLES = ["Mr.", "Ms.", "Mrs.", "Dr."]
+WORDS = (
+    "the committee economy energy policy bill budget inflation border security administration "
+    "federal agency regulation market families cost jobs growth prices oil gas climate health "
+    "pandemic origin research data artificial intelligence oversight transparency witness record "
+    "support oppose believe important question answer american people government states"
+).split()
+
+
+# ----------------------------------------------------------------------
+# Synthetic corpus
+
+def _sentence(rng, n_words=12):
+    words = rng.choice(WORDS, size=n_words)
+    return " ".join(words).capitalize() + "."
+
+
+def _speakers(rng, n):
+    names = set()
+    while len(names) < n:
+        names.add(f"{rng.choice(TITLES)} {''.join(rng.choice(SYLLABLES, size=3)).capitalize()}")
+    return sorted(names)
+
+
+def _transcript(rng, speakers, n_turns):
+    """
+    A transcript in the format parse_hearing.py expects, and its segments.
+    """
+    lines, segments = [], []
+
+    for _ in range(n_turns):
+        who = rng.choice(speakers)
+        paragraphs = [" ".join(_sentence(rng) for _ in range(rng.integers(1, 5))) for _ in range(rng.integers(1, 4))]
+
+        lines.append(f"{who}. {paragraphs[0]}")
+        lines.extend(f"    {p}" for p in paragraphs[1:])
+        segments.append(f"{who} " + "\n\n".join(paragraphs))
+
+    return "\n".join(lines) + "\n", segments
+
+
+def _export(rng, segments, stances, annotator, first_task):
+    """
+    A Label Studio export with the same metadata as a real one.
+    """
+    tasks = []
+
+    for i, (segment, row) in enumerate(zip(segments, stances), start=1):
+        result = [
+            {
+                "value": {"choices": [STANCES[int(s)]]},
+                "id": f"{rng.integers(1 << 40):x}",
+                "from_name": f"stance-on-topic-{t + 1}",
+                "to_name": "text",
+                "type": "choices",
+                "origin": "manual",
+            }
+            for t, s in enumerate(row)
+        ]
+        tasks.append({
+            "id": first_task + i,
+            "annotations": [{
+                "id": first_task + i,
+                "completed_by": annotator,
+                "result": result,
+                "was_cancelled": False,
+                "ground_truth": False,
+                "created_at": "2025-06-05T11:37:57.460387Z",
+                "updated_at": "2025-06-05T11:37:57.460412Z",
+                "lead_time": float(rng.uniform(5, 400)),
+                "result_count": len(result),
+                "unique_id": f"{rng.integers(1 << 62):016x}",
+                "task": first_task + i,
+            }],
+            "data": {"id": i, "text": segment},
+        })
+
+    return tasks
+
+
+def _perturb(rng, labels, keep=0.85):
+    noise = rng.integers(-1, 2, size=labels.shape)
+    return np.where(rng.random(labels.shape) < keep, labels, noise)
+
+
+def generate_hearing(path, rng, n_speakers=12, n_topics=7, n_turns=170):
+    """
+    Write one synthetic hearing: transcript, topics, two Label Studio exports,
+    their ground truths, the merged ground truth and all model outputs.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    speakers = _speakers(rng, n_speakers)
+    topics = [f"Topic {t + 1}" for t in range(n_topics)]
+    transcript, segments = _transcript(rng, speakers, n_turns)
+
+    with open(f"{path}/hearing.txt", "w", encoding="utf-8") as f:
+        f.write(transcript)
+    with open(f"{path}/topics.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(topics) + "\n")
+
+    # Most segments are neutral on most topics; the second annotator mostly agrees
+    stances = np.where(rng.random((n_turns, n_topics)) < 0.15, rng.choice([-1, 1], size=(n_turns, n_topics)), 0)
+    annotators = [stances, _perturb(rng, stances, keep=0.9)]
+
+    for a, labels in enumerate(annotators, start=1):
+        tasks = _export(rng, segments, labels, annotator=a, first_task=a * n_turns)
+        with open(f"{path}/annotations_{a}.json", "w", encoding="utf-8") as f:
+            json.dump(tasks, f)
+
+        ingested = ingest_annotations(tasks)
+        table = aggregate_stances(ingested, n_topics)
+        write_ground_truth(["Speaker"] + topics, [[sp] + row for sp, row in zip(ingested["speakers"], table.tolist())],
+                           folder=path, filename=f"ground_truth_{a}")
+
+    create_ground_truth([f"{path}/ground_truth_1.csv", f"{path}/ground_truth_2.csv"], f"{path}/ground_truth.csv")
+
+    truth = np.array(table)
+    for model in MODELS:
+        os.makedirs(f"{path}/output/{model}", exist_ok=True)
+        for prompt_file in PROMPT_FILES:
+            rows = [[sp] + row for sp, row in zip(ingested["speakers"], _perturb(rng, truth, keep=0.7).tolist())]
+            write_ground_truth(["Speaker"] + topics, rows, folder=f"{path}/output/{model}", filename=prompt_file[:-4])
+
+
+def generate_corpus(base_dir, n_hearings=10, seed=0, **sizes):
+    rng = np.random.default_rng(seed)
+    for h in range(n_hearings):
+        generate_hearing(f"{base_dir}/hearing-{h:05d}", rng, **sizes)
+
+
+# ----------------------------------------------------------------------
+# Benchmarks
+
+def _hearings(base_dir):
+    return [f"{base_dir}/{h}" for h in sorted(os.listdir(base_dir)) if os.path.isdir(f"{base_dir}/{h}")]
+
+
+def bench_parse_hearing(base_dir):
+    for path in _hearings(base_dir):
+        with open(f"{path}/hearing.txt", "r", encoding="utf-8") as f:
+            for _ in iter_segments(f):
+                pass
+
+
+def bench_ground_truth_table(base_dir):
+    for path in _hearings(base_dir):
+        with open(f"{path}/annotations_1.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+        create_ground_truth_table(parse_txt_to_list(f"{path}/topics.txt"), [parse_annotations(ann) for ann in data])
+
+
+def bench_ground_truth_stream(base_dir):
+    for path in _hearings(base_dir):
+        topics = parse_txt_to_list(f"{path}/topics.txt")
+        with open(f"{path}/annotations_1.json", "r", encoding="utf-8") as f:
+            aggregate_stances(ingest_annotations(iter_export(f)), len(topics))
+
+
+def bench_prompt_assembly(base_dir):
+    load_hearing.cache_clear()
+    components = load_components()
+    for path in _hearings(base_dir):
+        hearing = load_hearing(path)
+        for prompt in SECTIONS:
+            "".join(iter_prompt(prompt, components, hearing))
+
+
+def bench_evaluation(base_dir):
+    evaluation.evaluate_corpus(base_dir, MODELS, PROMPT_FILES)
+
+
+def bench_bootstrap_p(base_dir):
+    n = len(_hearings(base_dir)) * len(MODELS)
+    bootstrap.bootstrap_p(np.random.default_rng(0).normal(0.01, 0.05, size=n))
+
+
+def bench_kappa(base_dir):
+    agreement.corpus_agreement(base_dir)
+
+
+BENCHMARKS = {
+    "parse_hearing": bench_parse_hearing,
+    "create_ground_truth_table": bench_ground_truth_table,
+    "ground_truth_stream": bench_ground_truth_stream,
+    "prompt_assembly": bench_prompt_assembly,
+    "evaluation": bench_evaluation,
+    "bootstrap_p": bench_bootstrap_p,
+    "kappa": bench_kappa,
+}
+
+
+# Entry points whose start-up time matters, and the packages they should not
+# import at module load
+CLIS = ["evaluate", "evaluate_all_hearings", "bootstrap", "calculate_cohens_kappa", "calculate_iaa_avg",
+        "find_differences", "create_ground_truth", "parse_hearing", "create_xml", "create_prompt", "label_store",
+        "telemetry", "run_grid", "call_chatgpt", "segment_inference", "retrieve_topics", "pipeline"]
+HEAVY = ["openai", "sklearn", "pandas", "scipy", "multiprocessing"]
+
+
+def import_time(module, repeat=5):
+    """
+    Best cumulative import time of a module in a fresh interpreter, in
+    seconds, as reported by -X importtime, and the heavy packages it loads.
+    """
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    best = float("inf")
+
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        # Lines read "import time: self [us] | cumulative | name"
+        for line in proc.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                best = min(best, int(fields[1]) / 1e6)
+
+    return best, proc.stdout.split()
+
+
+def run_benchmarks(base_dir, names=None, repeat=3):
+    """
+    Time every benchmark `repeat` times. Returns {name: {min, median, runs}} in seconds.
+    """
+    results = {}
+
+    for name in names or BENCHMARKS:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            BENCHMARKS[name](base_dir)
+            runs.append(time.perf_counter() - start)
+
+        results[name] = {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+        print(f"{name:28} {results[name]['median'] * 1000:10.1f} ms")
+
+    return results
+
+
+def find_regressions(results, baseline, threshold=0.2):
+    """
+    Benchmarks whose best run is more than `threshold` slower than in the
+    baseline, as {name: ratio}. The best run is the least affected by noise.
+    """
+    return {
+        name: result["min"] / baseline[name]["min"]
+        for name, result in results.items()
+        if name in baseline and result["min"] > baseline[name]["min"] * (1 + threshold)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmark the pipeline on a synthetic corpus")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Write a synthetic corpus")
+    gen.add_argument('-n', '--hearings', type=int, default=10)
+    gen.add_argument('-o', '--output', default=".cache/benchmark")
+    gen.add_argument('--speakers', type=int, default=12)
+    gen.add_argument('--topics', type=int, default=7)
+    gen.add_argument('--turns', type=int, default=170)
+    gen.add_argument('--seed', type=int, default=0)
+
+    run = sub.add_parser("run", help="Time the benchmarks on a corpus")
+    run.add_argument('-d', '--data', default=".cache/benchmark")
+    run.add_argument('-b', '--benchmarks', nargs='+', choices=list(BENCHMARKS))
+    run.add_argument('-r', '--repeat', type=int, default=3)
+    run.add_argument('-o', '--output', default="benchmark.json")
+    run.add_argument('--baseline', help="Earlier results to compare against")
+    run.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+
+    imports = sub.add_parser("imports", help="Measure the import time of the entry points with -X importtime")
+    imports.add_argument('-m', '--modules', nargs='+', default=CLIS)
+    imports.add_argument('-r', '--repeat', type=int, default=5)
+    imports.add_argument('--budget', type=float, help="Exit with an error when a module takes longer (in ms)")
+
+    args = parser.parse_args()
+
+    if args.command == "imports":
+        over = []
+        for module in args.modules:
+            seconds, heavy = import_time(module, args.repeat)
+            print(f"{module:28} {seconds * 1000:10.1f} ms  {' '.join(heavy)}")
+            if args.budget is not None and seconds * 1000 > args.budget:
+                over.append(module)
+
+        for module in over:
+            print(f"⨉ {module} takes longer than {args.budget:.0f} ms to import")
+        sys.exit(1 if over else 0)
+
+    if args.command == "generate":
+        start = time.perf_counter()
+        generate_corpus(args.output, args.hearings, args.seed,
+                        n_speakers=args.speakers, n_topics=args.topics, n_turns=args.turns)
+        print(f"✓ Generated {args.hearings} hearings in {args.output} ({time.perf_counter() - start:.1f} s)")
+        sys.exit()
+
+    results = run_benchmarks(args.data, args.benchmarks, args.repeat)
+
+    report = {
+        "meta": {
+            "hearings": len(_hearings(args.data)),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, ratio in regressions.items():
+            print(f"⨉ {name} is {ratio:.2f}× slower than the baseline")
+
+        if regressions:
+            sys.exit(1)
+        print(f"✓ No benchmark is more than {args.threshold:.0%} slower than the baseline")
@@ -1,43 +1,129 @@
-import os
 import json
 import numpy as np
-import pandas as pd
 from collections import defaultdict
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-
-def compute_metrics(y_true, y_pred):
-    return {
-        'accuracy':  accuracy_score(y_true, y_pred),
-        'precision': precision_score(y_true, y_pred, average='macro', zero_division=0),
-        'recall':    recall_score(y_true, y_pred, average='macro', zero_division=0),
-        'f1':        f1_score(y_true, y_pred, average='macro', zero_division=0),
-    }
-
-def evaluate(gt_path, res_path):
-    df_gt = pd.read_csv(gt_path)
-    df_rs = pd.read_csv(res_path)
-    y_true, y_pred = [], []
-    for col in df_gt.columns:
-        if col != 'Speaker' and col in df_rs.columns:
-            y_true.extend(df_gt[col].tolist())
-            y_pred.extend(df_rs[col].tolist())
-    if not y_true or len(y_true) != len(y_pred):
-        return None
-    return compute_metrics(y_true, y_pred)
+from statistics import NormalDist
 
-def bootstrap_p(diffs, n_iter=5000, seed=0):
+import evaluation
+
+# Bytes of resampled values held at once (per process)
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+def _resample_means(diffs, n_resamples, seed, budget=MEMORY_BUDGET):
+    """
+    Means of n_resamples bootstrap resamples of every row of diffs (k × n),
+    all rows sharing one index matrix. Returns a k × n_resamples array.
+    Resamples are taken in blocks whose k × block × n values fit in budget
+    bytes; the blocks continue the same random stream.
+    """
     rng = np.random.default_rng(seed)
+    k, n = diffs.shape
+    block = max(1, budget // (k * n * diffs.itemsize))
+
+    means = np.empty((k, n_resamples))
+    for start in range(0, n_resamples, block):
+        size = min(block, n_resamples - start)
+        idx = rng.integers(0, n, size=(size, n))
+        means[:, start:start + size] = diffs[:, idx].mean(axis=2)
+    return means
+
+def bootstrap_means(diffs, n_iter=5000, seed=0, chunk_size=10000, jobs=1, budget=MEMORY_BUDGET):
+    """
+    Bootstrap distribution of the mean of every row of diffs (k × n).
+
+    Resamples are drawn in chunks of chunk_size, the unit of work of the
+    process pool. With more than one chunk, every chunk gets its own stream
+    from SeedSequence.spawn, so the result depends on seed and chunk_size
+    but not on jobs or budget. A single chunk draws from default_rng(seed)
+    exactly like rng.choice in a loop. Memory is bounded by budget bytes per
+    process, however many tests and hearings there are.
+    """
+    diffs = np.atleast_2d(np.asarray(diffs, dtype=float))
+    sizes = [min(chunk_size, n_iter - start) for start in range(0, n_iter, chunk_size)]
+
+    if len(sizes) == 1:
+        seeds = [seed]
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if jobs > 1 and len(sizes) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunks = list(pool.map(_resample_means, [diffs] * len(sizes), sizes, seeds, [budget] * len(sizes)))
+    else:
+        chunks = [_resample_means(diffs, size, s, budget) for size, s in zip(sizes, seeds)]
+
+    return np.concatenate(chunks, axis=1)
+
+def confidence_intervals(diffs, boot_means, confidence=0.95, method="percentile"):
+    """
+    Two-sided percentile or BCa intervals for the mean of every row of diffs.
+    BCa falls back to the percentile interval when a row has no variance.
+    """
+    diffs = np.atleast_2d(np.asarray(diffs, dtype=float))
+    alpha = (1 - confidence) / 2
+    levels = np.tile([alpha, 1 - alpha], (len(diffs), 1))
+
+    if method == "bca":
+        normal = NormalDist()
+        n = diffs.shape[1]
+
+        for k, (row, boot) in enumerate(zip(diffs, boot_means)):
+            # Bias correction from the share of resamples below the estimate
+            below = np.mean(boot < row.mean())
+            # Acceleration from the jackknife means
+            jack = (row.sum() - row) / max(n - 1, 1)
+            d = jack.mean() - jack
+            denom = 6 * np.sum(d ** 2) ** 1.5
+
+            if not 0 < below < 1 or denom == 0:
+                continue
+
+            z0 = normal.inv_cdf(below)
+            a = np.sum(d ** 3) / denom
+
+            for j, level in enumerate((alpha, 1 - alpha)):
+                z = z0 + normal.inv_cdf(level)
+                levels[k, j] = normal.cdf(z0 + z / (1 - a * z))
+
+    low = np.array([np.quantile(b, q) for b, q in zip(boot_means, levels[:, 0])])
+    high = np.array([np.quantile(b, q) for b, q in zip(boot_means, levels[:, 1])])
+    return low, high
+
+def bootstrap_p(diffs, n_iter=5000, seed=0):
     diffs = np.array(diffs)
-    boot_means = []
-    for _ in range(n_iter):
-        sample = rng.choice(diffs, size=len(diffs), replace=True)
-        boot_means.append(sample.mean())
-    boot_means = np.array(boot_means)
+    boot_means = bootstrap_means(diffs, n_iter, seed)[0]
     # one-tailed p-value: proportion of boot_means ≤ 0
     p = np.mean(boot_means <= 0)
     return diffs.mean(), p
 
-def main(data_dir='hearings'):
+def bootstrap_tests(tests, n_iter=5000, seed=0, chunk_size=10000, jobs=1, ci="percentile", confidence=0.95,
+                    budget=MEMORY_BUDGET):
+    """
+    Run every test of {name: diffs} in one batch per sample size. Returns
+    {name: (mean_diff, p, ci_low, ci_high)}.
+    """
+    by_size = defaultdict(list)
+    for name, diffs in tests.items():
+        by_size[len(diffs)].append(name)
+
+    results = {}
+
+    for names in by_size.values():
+        diffs = np.array([tests[name] for name in names], dtype=float)
+        boot = bootstrap_means(diffs, n_iter, seed, chunk_size, jobs, budget)
+
+        # one-tailed p-values: proportion of boot means ≤ 0
+        p = np.mean(boot <= 0, axis=1)
+        low, high = confidence_intervals(diffs, boot, confidence, ci)
+
+        for i, name in enumerate(names):
+            results[name] = (diffs[i].mean(), p[i], low[i], high[i])
+
+    return results
+
+def main(data_dir='hearings', n_iter=5000, seed=0, chunk_size=10000, jobs=1, ci='percentile', confidence=0.95,
+         budget=MEMORY_BUDGET):
     MODELS    = ['chatgpt-4o-latest', 'o3']
     CONTRASTS = [
         ('few_shot.csv',      'zero_shot.csv'),
@@ -45,70 +131,79 @@ def main(data_dir='hearings'):
         ('zero_shot_cot.csv', 'zero_shot.csv'),
         ('zero_shot_cot.csv', 'few_shot_cot.csv'),
     ]
-    METRICS   = ['accuracy', 'precision', 'recall', 'f1']
-
-    # 1) collect metrics per (model, prompt)
-    scores = defaultdict(list)
-    for hearing in os.listdir(data_dir):
-        gt = os.path.join(data_dir, hearing, 'ground_truth.csv')
-        if not os.path.isfile(gt):
-            continue
-        for model in MODELS:
-            out = os.path.join(data_dir, hearing, 'output', model)
-            if not os.path.isdir(out):
-                continue
-            for prompt in {c for pair in CONTRASTS for c in pair}:
-                path = os.path.join(out, prompt)
-                if os.path.isfile(path):
-                    m = evaluate(gt, path)
-                    if m:
-                        scores[(model, prompt)].append(m)
+    METRICS   = evaluation.METRICS
 
-    results = {}
+    # 1) collect metrics per (model, prompt), by hearing
+    prompts = sorted({c for pair in CONTRASTS for c in pair})
+    scores = defaultdict(dict)
+    for hearing, confusions in evaluation.evaluate_corpus(data_dir, MODELS, prompts, jobs=jobs):
+        for (model, prompt), conf in confusions.items():
+            scores[(model, prompt)][hearing] = evaluation.scores(conf)
+
+    # 2) per-model and pooled differences for every contrast and metric, on
+    #    the hearings where both outputs exist and could be aligned
+    tests, dropped = {}, {}
+
+    def pairs(model, cot, base):
+        shared = sorted(scores[(model, cot)].keys() & scores[(model, base)].keys())
+        missing = len(scores[(model, cot)].keys() | scores[(model, base)].keys()) - len(shared)
+        return [(scores[(model, cot)][h], scores[(model, base)][h]) for h in shared], missing
+
+    paired = {}
 
-    # 2) per-model bootstrap tests
     for model in MODELS:
         for cot, base in CONTRASTS:
             key = f'{model}: {cot} > {base}'
-            results[key] = {}
-            diffs_by_metric = {metric: [] for metric in METRICS}
-            cot_list  = scores[(model, cot)]
-            base_list = scores[(model, base)]
-            for m_cot, m_base in zip(cot_list, base_list):
-                for metric in METRICS:
-                    diffs_by_metric[metric].append(m_cot[metric] - m_base[metric])
+            paired[key], dropped[key] = pairs(model, cot, base)
             for metric in METRICS:
-                diffs = diffs_by_metric[metric]
-                if len(diffs) < 1:
-                    results[key][metric] = {'mean_diff': None, 'p': None}
-                else:
-                    mean_diff, p = bootstrap_p(diffs)
-                    results[key][metric] = {
-                        'mean_diff': round(mean_diff, 4),
-                        'p':          round(p, 4)
-                    }
-
-    # 3) pooled bootstrap tests across both models
+                tests[(key, metric)] = [m_cot[metric] - m_base[metric] for m_cot, m_base in paired[key]]
+
     for cot, base in CONTRASTS:
         key = f'pooled: {cot} > {base}'
-        results[key] = {}
+        dropped[key] = sum(dropped[f'{model}: {cot} > {base}'] for model in MODELS)
         for metric in METRICS:
-            diffs = []
-            for model in MODELS:
-                cot_list  = scores[(model, cot)]
-                base_list = scores[(model, base)]
-                for m_cot, m_base in zip(cot_list, base_list):
-                    diffs.append(m_cot[metric] - m_base[metric])
-            if not diffs:
-                results[key][metric] = {'mean_diff': None, 'p': None}
-            else:
-                mean_diff, p = bootstrap_p(diffs)
-                results[key][metric] = {
-                    'mean_diff': round(mean_diff, 4),
-                    'p':          round(p, 4)
-                }
+            tests[(key, metric)] = [
+                m_cot[metric] - m_base[metric]
+                for model in MODELS
+                for m_cot, m_base in paired[f'{model}: {cot} > {base}']
+            ]
+
+    # 3) bootstrap all tests in batches
+    boot = bootstrap_tests({name: d for name, d in tests.items() if d}, n_iter, seed, chunk_size, jobs, ci, confidence,
+                           budget)
+
+    # n is the number of paired hearings, dropped the hearings where only
+    # one of the two outputs exists or could be aligned
+    results = {}
+    for (key, metric), diffs in tests.items():
+        counts = {'n': len(diffs), 'dropped': dropped[key]}
+        if (key, metric) not in boot:
+            results.setdefault(key, {})[metric] = {'mean_diff': None, 'p': None, 'ci_low': None, 'ci_high': None,
+                                                   **counts}
+        else:
+            mean_diff, p, low, high = boot[(key, metric)]
+            results.setdefault(key, {})[metric] = {
+                'mean_diff': round(mean_diff, 4),
+                'p':          round(p, 4),
+                'ci_low':     round(low, 4),
+                'ci_high':    round(high, 4),
+                **counts,
+            }
 
     print(json.dumps(results, indent=2))
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=5000, help="Number of bootstrap resamples")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Resamples drawn at once")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Processes used for evaluation and resampling")
+    parser.add_argument('--ci', default='percentile', choices=['percentile', 'bca'])
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--memory', type=float, default=MEMORY_BUDGET / 1024 / 1024,
+                        help="MB of resampled values held at once per process")
+    args = parser.parse_args()
+
+    main(n_iter=args.iterations, seed=args.seed, chunk_size=args.chunk_size, jobs=args.jobs,
+         ci=args.ci, confidence=args.confidence, budget=int(args.memory * 1024 * 1024))
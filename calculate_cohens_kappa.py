@@ -1,7 +1,8 @@
 import argparse
 import json
-import pandas as pd
-from sklearn.metrics import cohen_kappa_score
+
+from agreement import cohen_kappa, speaker_units
+from label_store import read_table
 
 
 def compute_cohens_kappa_from_csvs(path1: str, path2: str) -> dict:
@@ -15,21 +16,11 @@ def compute_cohens_kappa_from_csvs(path1: str, path2: str) -> dict:
     Returns:
         dict: Mapping from stance target to Cohen's Kappa score.
     """
-    # Load both CSVs
-    df1 = pd.read_csv(path1, index_col=0)
-    df2 = pd.read_csv(path2, index_col=0)
-    
-    if not df1.columns.equals(df2.columns) or not df1.index.equals(df2.index):
-        raise ValueError("Both CSVs must have identical columns and row indices.")
-    
-    kappas = {}
-    for col in df1.columns:
-        labels1 = df1[col].tolist()
-        labels2 = df2[col].tolist()
-        kappa = cohen_kappa_score(labels1, labels2)
-        kappas[col] = kappa
-    
-    return kappas
+    # All topics at once, one confusion matrix per topic
+    ratings, groups, topics = speaker_units([read_table(path1), read_table(path2)])
+    kappas = cohen_kappa(ratings, groups, len(topics))
+
+    return {topic: float(kappa) for topic, kappa in zip(topics, kappas)}
 
 
 if __name__ == "__main__":
@@ -1,26 +1,48 @@
-import os
+import argparse
 import json
 
-def compute_average_kappa_across_hearings(base_dir: str = "hearings") -> float:
-    kappa_values = []
+from agreement import STATISTICS, corpus_agreement
 
-    for hearing in os.listdir(base_dir):
-        hearing_path = os.path.join(base_dir, hearing)
-        iaa_path = os.path.join(hearing_path, "iaa.json")
+NAMES = {"cohen": "kappa", "fleiss": "Fleiss' kappa", "alpha": "Krippendorff's alpha"}
 
-        if os.path.isdir(hearing_path) and os.path.isfile(iaa_path):
-            with open(iaa_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                avg_kappa = data.get("average_kappa", None)
-                if avg_kappa is not None:
-                    kappa_values.append(avg_kappa)
 
-    if not kappa_values:
-        print("No valid average_kappa values found.")
+def compute_average_kappa_across_hearings(base_dir: str = "hearings", level: str = "speaker", metric: str = "cohen",
+                                          n_boot: int = 0, seed: int = 0, confidence: float = 0.95,
+                                          output: str | None = None) -> float:
+    results = corpus_agreement(base_dir, level=level, metric=metric, n_boot=n_boot, seed=seed, confidence=confidence)
+
+    if results["average"] is None:
+        print("No hearings with at least two annotators found.")
         return 0.0
 
-    overall_avg = sum(kappa_values) / len(kappa_values)
-    print(f"Average kappa across {len(kappa_values)} hearings: {overall_avg:.4f}")
+    overall_avg = results["average"]
+    print(f"Average {NAMES[metric]} across {len(results['hearings'])} hearings: {overall_avg:.4f}")
+
+    if "ci" in results:
+        low, high = results["ci"]
+        print(f"{confidence:.0%} bootstrap interval: [{low:.4f}, {high:.4f}]")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Saved per-topic and per-hearing agreement to {output}")
+
     return overall_avg
 
-compute_average_kappa_across_hearings("hearings")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Calculate inter-annotator agreement of the corpus")
+
+    parser.add_argument('-d', '--base-dir', default="hearings")
+    parser.add_argument('-l', '--level', default="speaker", choices=["speaker", "segment"],
+                        help="Compare ground_truth_<n>.csv tables or the segments of annotations_<n>.json")
+    parser.add_argument('-m', '--metric', default="cohen", choices=list(STATISTICS))
+    parser.add_argument('-n', '--bootstrap', type=int, default=0, help="Bootstrap resamples for confidence intervals")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('-o', '--output', help="Write all results to this JSON file")
+
+    args = parser.parse_args()
+
+    compute_average_kappa_across_hearings(args.base_dir, args.level, args.metric, args.bootstrap, args.seed,
+                                          args.confidence, args.output)
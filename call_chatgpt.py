@@ -1,8 +1,17 @@
 import argparse
+import json
 import os
+import random
+import sys
 import time
 from pathlib import Path
-from openai import OpenAI
+
+import llm_cache
+import telemetry
+from create_prompt import build_prompt, load_hearing
+from output_format import (OutputFormatError, check_record, feed_validator, finish_validator, new_validator,
+                           validate_output)
+from structured_output import schema_of, structured_table, text_format
 
 
 def strip_backticks(csv_string: str) -> str:
@@ -17,12 +26,164 @@ def strip_backticks(csv_string: str) -> str:
     return "\n".join(lines)
 
 
+def write_output(output_path: str, prompt_name: str, record: dict):
+    """
+    Write the raw response and, next to it, the cleaned CSV taken from it.
+    Structured outputs (see structured_output.py) are converted to CSV; one
+    that was cut off, refused or does not match its schema raises
+    OutputFormatError before anything is written.
+    """
+    if schema_of(record.get("params")) is None:
+        table = strip_backticks(record["output_text"])
+    else:
+        table = structured_table(record)
+
+    with open(f"{output_path}/{prompt_name}.response.json", mode="w", encoding="utf-8") as file:
+        json.dump(record, file, indent=2, ensure_ascii=False)
+
+    with open(f"{output_path}/{prompt_name}.csv", mode="w") as file:
+        file.write(table)
+
+
+def with_retries(request, model, prompt, tags=None, retries=2, backoff=2.0):
+    """
+    Return request(attempt), retrying connection errors, rate limits and
+    server errors with exponential backoff (and jitter), as run_grid.py
+    does. request gets the number of retries so far, for its telemetry; a
+    failure that is not retried is recorded as a telemetry event.
+    """
+    # run_grid imports this module, so it is only imported once both are loaded
+    from run_grid import is_retryable
+
+    start = time.perf_counter()
+
+    for attempt in range(retries + 1):
+        try:
+            return request(attempt)
+        except OutputFormatError:
+            # Already recorded, and asked again as often as allowed
+            raise
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                telemetry.record(telemetry.make_event(
+                    model, prompt, None, tags, total=time.perf_counter() - start, retries=attempt,
+                    error=f"{e.__class__.__name__}: {e}",
+                ))
+                raise
+
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f"⚠ {e.__class__.__name__}, retry {attempt + 1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def create_response(client, model, prompt, params=None, format_retries=2, tags=None, retries=0):
+    """
+    Send a prompt and return the response. With a structured-output format
+    in params, a response that was cut off, refused or does not match the
+    schema is asked again up to format_retries times, after which
+    OutputFormatError is raised. retries is recorded in the telemetry.
+    """
+    for attempt in range(format_retries + 1):
+        sent = time.perf_counter()
+        with client.responses.with_streaming_response.create(
+            model=model,
+            input=prompt,
+            **(params or {}),
+        ) as raw:
+            ttfb = time.perf_counter() - sent
+            response = raw.parse()
+        latency = time.perf_counter() - sent
+
+        try:
+            if schema_of(params) is not None:
+                structured_table(llm_cache.make_record(model, params, response))
+        except OutputFormatError as e:
+            telemetry.record(telemetry.make_event(model, prompt, response, tags, ttfb=ttfb, latency=latency,
+                                                  retries=retries, format_retries=attempt,
+                                                  error=f"OutputFormatError: {e}"))
+            if attempt >= format_retries:
+                raise
+            print(f"⚠ Unusable structured output ({e}), asking again {attempt + 1}/{format_retries}")
+            continue
+
+        telemetry.record(telemetry.make_event(
+            model, prompt, response, tags, ttfb=ttfb, latency=latency, retries=retries, format_retries=attempt,
+        ))
+        return response
+
+
+def stream_response(client, model, prompt, speakers, topics, part_path, format_retries=2, tags=None, retries=0):
+    """
+    Stream a response and check it row by row against the expected speakers
+    and topics, writing the valid rows to part_path as they arrive. Off-format
+    outputs are aborted at once and asked again up to format_retries times;
+    the last attempt is not checked. Returns the final response. retries is
+    recorded in the telemetry.
+    """
+    for attempt in range(format_retries + 1):
+        validator = new_validator(speakers, topics) if attempt < format_retries else None
+        ttfb = ttft = None
+        sent = time.perf_counter()
+
+        try:
+            with open(part_path, "w", encoding="utf-8") as part, \
+                 client.responses.stream(model=model, input=prompt) as stream:
+                for event in stream:
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - sent
+                    if event.type != "response.output_text.delta":
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - sent
+
+                    if validator is None:
+                        part.write(event.delta)
+                    else:
+                        part.writelines(row + "\n" for row in feed_validator(validator, event.delta))
+                    part.flush()
+
+                response = stream.get_final_response()
+
+                missing = []
+                if validator is not None:
+                    rows, missing = finish_validator(validator)
+                    part.writelines(row + "\n" for row in rows)
+
+        except OutputFormatError as e:
+            failed_after = time.perf_counter() - sent
+            telemetry.record(telemetry.make_event(model, prompt, None, tags, latency=failed_after, retries=retries,
+                                                  format_retries=attempt, aborted=True,
+                                                  error=f"OutputFormatError: {e}"))
+            print(f"⚠ Off-format output after {failed_after:.1f}s ({e}), asking again {attempt + 1}/{format_retries}")
+            continue
+
+        if missing:
+            print(f"⚠ No row for {', '.join(missing)}")
+
+        telemetry.record(telemetry.make_event(
+            model, prompt, response, tags, ttfb=ttfb, ttft=ttft, latency=time.perf_counter() - sent, retries=retries,
+            format_retries=attempt, missing=len(missing),
+        ))
+        return response
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="Call ChatGPT")
     
     parser.add_argument('folder')
     parser.add_argument('-p', '--prompt', default="0")
     parser.add_argument('-m', '--model', default="chatgpt-4o-latest")
+    parser.add_argument('--build', action='store_true', help="Compile prompts in memory instead of reading prompts/")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, then refresh the cache")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--stream', action='store_true',
+                      help="Stream the response, check every row and ask again as soon as it is off-format")
+    mode.add_argument('--structured', action='store_true',
+                      help="Constrain the output to a JSON schema of the hearing's speakers and topics")
+    parser.add_argument('-r', '--retries', type=int, default=2, help="Retries after connection or server errors")
+    parser.add_argument('-b', '--backoff', type=float, default=2.0, help="Initial backoff in seconds")
+    parser.add_argument('--format-retries', type=int, default=2,
+                        help="Off-format outputs asked again with --stream or --structured")
 
     args = parser.parse_args()
 
@@ -31,7 +192,12 @@ if __name__ == "__main__":
     prompt_type = int(args.prompt)
     model = f"{args.model}"
 
-    client = OpenAI()
+    # openai takes most of a second to import, so modules that only need
+    # write_output() or strip_backticks() do not import it
+    from openai import OpenAI
+
+    # Retries are done by with_retries(), so that telemetry counts them
+    client = OpenAI(max_retries=0)
 
     prompts = ["every", "zero_shot", "few_shot", "zero_shot_cot", "few_shot_cot"]
 
@@ -52,26 +218,76 @@ if __name__ == "__main__":
     i = 0
 
     while i < times_to_run:
-        prompt = Path(f"{path}/prompts/{prompts[prompt_type]}.txt").read_text(encoding="utf-8")
+        if args.build:
+            prompt = build_prompt(path, prompts[prompt_type])
+        else:
+            prompt = Path(f"{path}/prompts/{prompts[prompt_type]}.txt").read_text(encoding="utf-8")
 
-        print(f"✓ Calling {model} with {prompts[prompt_type]}")
+        tags = {"hearing": hearing, "prompt": prompts[prompt_type]}
+        params = None
+        if args.structured:
+            hearing_files = load_hearing(path)
+            params = {"text": text_format(hearing_files["speakers"], hearing_files["topics"])}
 
-        response = client.responses.create(
-            model=model,
-            input=prompt,
-        )
+        key = llm_cache.cache_key(model, prompt, params)
+        record = None if args.no_cache else llm_cache.load(key)
+
+        if record is not None and (args.stream or args.structured):
+            hearing_files = load_hearing(path)
+            try:
+                if args.stream:
+                    check_record(record, hearing_files["speakers"], hearing_files["topics"])
+                else:
+                    structured_table(record)
+            except OutputFormatError as e:
+                print(f"⚠ Cached output for {model} with {prompts[prompt_type]} is off-format ({e}), asking again")
+                record = None
+
+        cached = record is not None
+
+        if not cached:
+            print(f"✓ Calling {model} with {prompts[prompt_type]}")
+
+            if args.stream:
+                hearing_files = load_hearing(path)
+                part_path = f"{output_path}/{prompts[prompt_type]}.csv.part"
+                response = with_retries(
+                    lambda attempt: stream_response(client, model, prompt, hearing_files["speakers"],
+                                                    hearing_files["topics"], part_path, args.format_retries, tags,
+                                                    attempt),
+                    model, prompt, tags, args.retries, args.backoff,
+                )
+            else:
+                try:
+                    response = with_retries(
+                        lambda attempt: create_response(client, model, prompt, params, args.format_retries, tags,
+                                                        attempt),
+                        model, prompt, tags, args.retries, args.backoff,
+                    )
+                except OutputFormatError as e:
+                    sys.exit(f"⨉ No usable structured output from {model} with {prompts[prompt_type]}: {e}")
+
+            record = llm_cache.make_record(model, params, response)
+            if args.stream:
+                # The last attempt is accepted unchecked; later runs must not take it for a valid table
+                try:
+                    validate_output(record["output_text"], hearing_files["speakers"], hearing_files["topics"])
+                except OutputFormatError as e:
+                    record["invalid"] = str(e)
+            llm_cache.store(key, record)
+        else:
+            print(f"✓ Cache hit for {model} with {prompts[prompt_type]}")
+            telemetry.record(telemetry.make_event(model, prompt, None, tags, cached=True))
 
-        output = response.output_text
-        output_cleaned = strip_backticks(output)
+        write_output(output_path, prompts[prompt_type], record)
+        if os.path.isfile(f"{output_path}/{prompts[prompt_type]}.csv.part"):
+            os.remove(f"{output_path}/{prompts[prompt_type]}.csv.part")
 
-        with open(f"{output_path}/{prompts[prompt_type]}.csv", mode="w") as file:
-            file.write(output_cleaned)
-        
         print(f"✓ Wrote response to {output_path}/{prompts[prompt_type]}.csv")
 
         i += 1
         prompt_type += 1
 
-        if i < times_to_run:
+        if i < times_to_run and not cached:
             print("Pausing for 3 seconds...")
             time.sleep(3)
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import os
+import re
+
+from create_ground_truth import segment_speaker
+from create_prompt import estimate_tokens
+from parse_hearing import iter_turns
+
+# ----------------------------------------------------------------------
+# tune this list if your corpus contains other procedural phrases
+PROCEDURAL = re.compile(
+    r"""
+    without\ objection
+    | so\ ordered
+    | yields?\ back
+    | \bI\ yield\b
+    | ^(the\ (gentleman|gentlewoman|gentlelady|chair|chairman|chairwoman|ranking\ member)|you
+       |(Mr|Mrs|Ms|Dr|Sen|Rep)\.\ [\w'-]+)\b[^.!?]*\b(is|are)\ (now\ )?recognized\b
+    | \b(is|are)\ (now\ )?recognized\ for\ (\w+\ )?(minutes?|questions)\b
+    | \bI\ (now\ )?recognize\b
+    | \b(chair|chairman|chairwoman)\ recognizes\b
+    | come\ to\ order
+    | ^\[?recess\.?\]?$
+    | \bdeclare\ a\ recess\b
+    | ^(the\ (committee|subcommittee)|we)\b[^.!?]*\b(stands?\ in|going\ to|will)\ recess\b
+    | adjourned
+    | unanimous\ consent
+    | time\ (has\ )?expired
+    | legislative\ days
+    | the\ clerk\ will
+    | ^(thank\ you|thanks)\b((Mrs?|Ms|Dr|Sen|Rep)\.|[^.!?]){0,40}[.!?]?$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+# Sentences longer than this are kept even if they match, since they most
+# likely carry substance besides the procedural phrase
+MAX_PROCEDURAL_WORDS = 25
+
+# Titles and initials end in a period but not a sentence ("Mr. Chairman",
+# "U.S. economy")
+ABBREVIATIONS = ("Mr", "Mrs", "Ms", "Dr", "Sen", "Rep", "Gov", "Adm", "Gen", "Sec", "Hon", "Prof", "Lt", "Col", "vs")
+
+SENTENCE_END = re.compile(
+    r"(?<=[.!?\]])" + "".join(rf"(?<!\b{a}\.)" for a in ABBREVIATIONS) + r"(?<!\b[A-Z]\.)\s+"
+)
+
+
+def is_procedural(sentence: str) -> bool:
+    return len(sentence.split()) <= MAX_PROCEDURAL_WORDS and PROCEDURAL.search(sentence) is not None
+
+
+def compact_turn(utterance: str) -> str:
+    """
+    Collapse all whitespace and drop procedural sentences. Returns an empty
+    string when nothing but procedure is left.
+    """
+    sentences = SENTENCE_END.split(" ".join(utterance.split()))
+    return " ".join(s for s in sentences if s and not is_procedural(s))
+
+
+def compact_hearing(lines, speakers=None):
+    """
+    Yield compacted '<Speaker>. <utterance>' turns on a single line each. Turns of
+    speakers that are not in `speakers` are dropped when it is given.
+    """
+    for who, utterance in iter_turns(lines):
+        if speakers is not None and segment_speaker(who) not in speakers:
+            continue
+
+        text = compact_turn(utterance)
+        if text:
+            yield f"{who}. {text}"
+
+
+def read_speakers(filepath):
+    with open(filepath, mode='r') as file:
+        csv_file = csv.reader(file)
+        next(csv_file, None)    # Skip header line
+        return {lines[0] for lines in csv_file}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Compact a hearing transcript for prompting")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    parser.add_argument('-hr', '--hearing', default="hearing.txt")
+    parser.add_argument('-g', '--ground', default="ground_truth.csv")
+    parser.add_argument('-o', '--output', default="hearing_compact.txt")
+    parser.add_argument('-k', '--keep-speakers', action='store_true', help="Keep turns of speakers not in the ground truth")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+    hearings = args.hearings or sorted(h for h in os.listdir(base_dir) if os.path.isdir(f"{base_dir}/{h}"))
+
+    for hearing in hearings:
+        path = f"{base_dir}/{hearing}"
+
+        if not os.path.isfile(f"{path}/{args.hearing}"):
+            continue
+
+        speakers = None
+        if not args.keep_speakers and os.path.isfile(f"{path}/{args.ground}"):
+            speakers = read_speakers(f"{path}/{args.ground}")
+
+        with open(f"{path}/{args.hearing}", "r", encoding="utf-8") as f:
+            before = f.read()
+
+        after = "\n\n".join(compact_hearing(before.splitlines(), speakers))
+
+        with open(f"{path}/{args.output}", "w", encoding="utf-8") as f:
+            f.write(after)
+
+        print(
+            f"✓ {hearing}: {len(before)} → {len(after)} characters, "
+            f"~{estimate_tokens(before)} → ~{estimate_tokens(after)} tokens "
+            f"(-{1 - len(after) / len(before):.0%}) ({path}/{args.output})"
+        )
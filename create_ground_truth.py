@@ -1,5 +1,8 @@
 import argparse
 import json, csv
+import re
+from array import array
+import numpy as np
 
 
 def parse_stance(st):
@@ -11,10 +14,15 @@ def parse_stance(st):
         return 0
 
 
+def segment_speaker(segment):
+    # Segments start with the speaker's title and surname, e.g. "Mr. Fallon"
+    return " ".join(segment.split()[:2]).rstrip("., ")
+
+
 def parse_annotations(ann):
     segment = ann["data"]["text"]
 
-    speaker = " ".join(segment.split()[:2]).rstrip("., ")
+    speaker = segment_speaker(segment)
 
     stances = []
 
@@ -32,6 +40,90 @@ def parse_annotations(ann):
     }
 
 
+WHITESPACE = re.compile(r"\s*")
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_export(fp, chunk_size=1 << 20):
+    """
+    Yield the tasks of a Label Studio JSON export one by one, reading the file
+    in chunks instead of loading the whole array.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, started = "", 0, False
+
+    while True:
+        pos = (SEPARATORS if started else WHITESPACE).match(buffer, pos).end()
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("A Label Studio export must be a JSON array of tasks")
+                started, pos = True, pos + 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                task, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                pass    # the task continues in the next chunk
+            else:
+                yield task
+                continue
+
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            # Let the decoder report what is wrong with the rest
+            decoder.raw_decode(buffer, pos)
+            raise ValueError("Unexpected end of the Label Studio export")
+
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def ingest_annotations(tasks):
+    """
+    Keep only (task id, speaker, topic index, stance) of every stance in
+    compact arrays, with speakers as ids into a list in order of appearance.
+    Topic indices follow the order of the choices, as in parse_annotations().
+    """
+    speakers = {}
+    task_ids, speaker_ids, topic_ids, stances = array("q"), array("i"), array("h"), array("b")
+
+    for task in tasks:
+        speaker = speakers.setdefault(segment_speaker(task["data"]["text"]), len(speakers))
+        topic = 0
+
+        for res in task["annotations"][0]["result"]:
+            if "choices" in res["value"]:
+                task_ids.append(task["id"])
+                speaker_ids.append(speaker)
+                topic_ids.append(topic)
+                stances.append(parse_stance(res["value"]["choices"][0]))
+                topic += 1
+
+    return {
+        "speakers": list(speakers),
+        "task": np.frombuffer(task_ids, dtype=np.int64),
+        "speaker": np.frombuffer(speaker_ids, dtype=np.int32),
+        "topic": np.frombuffer(topic_ids, dtype=np.int16),
+        "stance": np.frombuffer(stances, dtype=np.int8),
+    }
+
+
+def aggregate_stances(ingested, n_topics):
+    """
+    Clamped sum of the stances of every speaker and topic, like
+    create_ground_truth_table(), as one grouped reduction: speakers × topics.
+    """
+    keep = ingested["topic"] < n_topics
+    cells = ingested["speaker"][keep].astype(np.int64) * n_topics + ingested["topic"][keep]
+    sums = np.bincount(cells, weights=ingested["stance"][keep], minlength=len(ingested["speakers"]) * n_topics)
+
+    return np.clip(sums.reshape(-1, n_topics), -1, 1).astype(np.int8)
+
+
 def parse_txt_to_list(filepath):
     with open(filepath, 'r', encoding='utf-8') as file:
         lines = [line.strip() for line in file if line.strip()]
@@ -116,6 +208,26 @@ def write_ground_truth(header, speaker_labels_array, folder=".", filename="groun
         writer.writerows(speaker_labels_array)
 
 
+def ground_truth_from_export(path, annotations="annotations_2.json", topics="topics.txt", output="ground_truth_2"):
+    """
+    Write the speaker-level ground truth of one Label Studio export of the
+    hearing in `path` to `path/output`.csv. Returns the number of speakers.
+    """
+    list_of_topics = parse_txt_to_list(f"{path}/{topics}")
+
+    # Stream the export rather than loading it, it is mostly metadata
+    with open(f"{path}/{annotations}", "r", encoding="utf-8") as f:
+        ingested = ingest_annotations(iter_export(f))
+
+    labels = aggregate_stances(ingested, len(list_of_topics))
+
+    header = ["Speaker"] + list_of_topics
+    speaker_labels_array = [[sp] + row for sp, row in zip(ingested["speakers"], labels.tolist())]
+    write_ground_truth(header, speaker_labels_array, folder=path, filename=output)
+
+    return len(speaker_labels_array)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="Hearing Ground Truth Creator")
     
@@ -128,27 +240,8 @@ if __name__ == "__main__":
 
     hearing = args.folder
     path = f"hearings/{hearing}"
-    label_studio_annotations = args.annotations
-    topics = args.topics
     output = args.output
 
-    # Opening JSON file
-    f = open(f"{path}/{label_studio_annotations}")
-
-    # returns JSON object as a dictionary
-    data = json.load(f)
-
-    ground_truth = []
-
-    for ann in data:
-        annotation = parse_annotations(ann)
-        ground_truth.append(annotation)
-
-    f.close()
-
-    list_of_topics = parse_txt_to_list(f"{path}/{topics}")
-
-    header, speaker_labels_array = create_ground_truth_table(list_of_topics, ground_truth)
-    write_ground_truth(header, speaker_labels_array, folder=path, filename=output)
+    ground_truth_from_export(path, args.annotations, args.topics, output)
 
     print(f"✓ Created ground truth table ({path}/{output}.csv)")
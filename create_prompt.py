@@ -1,8 +1,30 @@
 import argparse
 import csv
+from functools import lru_cache
 from pathlib import Path
 import os
 
+PROMPTS = ["every", "zero_shot", "few_shot", "zero_shot_cot", "few_shot_cot"]
+
+# Optional sections of each prompt variant, in the order they appear
+SECTIONS = {
+    "zero_shot": [],
+    "few_shot": ["examples"],
+    "zero_shot_cot": ["cot"],
+    "few_shot_cot": ["examples", "cot"],
+}
+
+HEADINGS = {
+    "examples": "EXAMPLES",
+    "cot": "REASONING",
+}
+
+# "classic" puts the variant sections right after the task, as in the paper.
+# "cache" moves them after the transcript so that all variants of a hearing
+# share everything up to the end of the transcript, which is what provider-side
+# prompt caching needs.
+LAYOUTS = ["classic", "cache"]
+
 
 def parse_txt_to_list(filepath):
     with open(filepath, 'r', encoding='utf-8') as file:
@@ -10,103 +32,138 @@ def parse_txt_to_list(filepath):
     return lines
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-                    prog="Create Labelling Template for Label Studio",
-                    description="What the program does",
-                    epilog="Text at the bottom of help")
-    
-    parser.add_argument('folder')
-    parser.add_argument('-g', '--ground', default="ground_truth.csv")
-    parser.add_argument('-a', '--transcript', default="hearing.txt")
-    parser.add_argument('-t', '--topics', default="topics.txt")
-    parser.add_argument('-p', '--prompt', default="0")
+@lru_cache(maxsize=None)
+def load_components(prompt_dir="prompts"):
+    """
+    Read the shared prompt components once per process.
+    """
+    return {
+        "task": Path(f"{prompt_dir}/base.txt").read_text(encoding="utf-8"),
+        "examples": Path(f"{prompt_dir}/examples.txt").read_text(encoding="utf-8"),
+        "cot": Path(f"{prompt_dir}/cot.txt").read_text(encoding="utf-8"),
+        "output": Path(f"{prompt_dir}/output.txt").read_text(encoding="utf-8"),
+        "segments": Path(f"{prompt_dir}/segments.txt").read_text(encoding="utf-8"),
+        "repair": Path(f"{prompt_dir}/repair.txt").read_text(encoding="utf-8"),
+    }
+
+
+@lru_cache(maxsize=16)
+def load_hearing(path, ground="ground_truth.csv", topics="topics.txt", transcript="hearing.txt"):
+    """
+    Read the per-hearing parts of a prompt. All variants of a hearing share the
+    returned transcript string.
+    """
+    list_of_speakers = []
 
-    args = parser.parse_args()
+    with open(f"{path}/{ground}", mode='r') as file:
+        csv_file = csv.reader(file)
+        next(csv_file, None)    # Skip header line
+        for lines in csv_file:
+            list_of_speakers.append(lines[0])
 
-    hearing = args.folder
-    path = f"hearings/{hearing}"
-    ground_truth = args.ground
-    topics = args.topics
-    prompt_type = int(args.prompt)
-    transcript = args.transcript
+    return {
+        "speakers": list_of_speakers,
+        "topics": parse_txt_to_list(f"{path}/{topics}"),
+        "transcript": Path(f"{path}/{transcript}").read_text(encoding="utf-8"),
+    }
 
-    prompts = ["every", "zero_shot", "few_shot", "zero_shot_cot", "few_shot_cot"]
 
-    prompt = prompts[prompt_type]
+def iter_sections(prompt, components):
+    for section in SECTIONS[prompt]:
+        yield HEADINGS[section] + "\n"
+        yield components[section] + "\n\n"
 
-    task = Path(f"prompts/base.txt").read_text(encoding="utf-8")
 
-    output_format = Path(f"prompts/output.txt").read_text(encoding="utf-8")
+def iter_prompt(prompt, components, hearing, layout="classic"):
+    """
+    Yield the pieces of a prompt in order. The transcript is yielded as the
+    shared string itself, so nothing large is copied until the caller joins.
+    """
+    if prompt not in SECTIONS:
+        raise Exception("Incorrect prompt type")
+    if layout not in LAYOUTS:
+        raise Exception("Incorrect prompt layout")
 
-    list_of_speakers = []
+    yield components["task"] + "\n\n"
 
-    with open(f"{path}/{ground_truth}", mode='r') as file:
-        csv_file = csv.reader(file)
-        next(csv_file, None)    # Skip header line
-        for lines in csv_file:
-            list_of_speakers.append(lines[0])
+    if layout == "classic":
+        yield from iter_sections(prompt, components)
+
+    yield "OUTPUT FORMAT\n"
+    yield components["output"] + "\n\n"
+
+    yield "LIST OF SPEAKERS\n"
+    yield ", ".join(hearing["speakers"]) + "\n\n\n"
+
+    yield "LIST OF TOPICS\n"
+    yield ", ".join(hearing["topics"]) + "\n\n\n"
 
-    list_of_topics = parse_txt_to_list(f"{path}/{topics}")
+    yield "HEARING TRANSCRIPT\n"
+    yield hearing["transcript"]
 
-    hearing_transcript = Path(f"{path}/{transcript}").read_text(encoding="utf-8")
+    if layout == "cache" and SECTIONS[prompt]:
+        yield "\n\n"
+        yield from iter_sections(prompt, components)
 
-    if not os.path.exists(f"{path}/prompts"):
-        os.makedirs(f"{path}/prompts")
 
-    times_to_run = 1
+def estimate_tokens(text):
+    """
+    Rough token count for English prose (about four characters per token).
+    """
+    return (len(text) + 3) // 4
 
-    if prompt_type == 0:
-        times_to_run = 4
-        prompt_type = 1
 
-    i = 0
+def shared_prefix_length(prompts):
+    """
+    Number of leading characters that all given prompts have in common.
+    """
+    return len(os.path.commonprefix(list(prompts)))
 
-    while i < times_to_run:
-        with open(f"{path}/prompts/{prompts[prompt_type]}.txt", mode="w") as file:
-            file.write(task + "\n\n")
 
-            if prompt_type == 1:   # zero-shot
-                pass
-            
-            elif prompt_type == 2: # few-shot
-                file.write("EXAMPLES\n")
-                examples = Path(f"prompts/examples.txt").read_text(encoding="utf-8")
-                file.write(examples + "\n\n")
+def build_prompt(path, prompt, prompt_dir="prompts", write=False, layout="classic", **files):
+    """
+    Compile one prompt variant for the hearing in `path` and return it as a
+    string. With write=True the prompt is also saved to `path/prompts/`.
+    """
+    parts = list(iter_prompt(prompt, load_components(prompt_dir), load_hearing(path, **files), layout))
+
+    if write:
+        os.makedirs(f"{path}/prompts", exist_ok=True)
+        with open(f"{path}/prompts/{prompt}.txt", mode="w", encoding="utf-8") as file:
+            file.writelines(parts)
+
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Create Labelling Template for Label Studio",
+                    description="What the program does",
+                    epilog="Text at the bottom of help")
 
-            elif prompt_type == 3: # zero-shot-cot
-                file.write("REASONING\n")
-                reasoning = Path(f"prompts/cot.txt").read_text(encoding="utf-8")
-                file.write(reasoning + "\n\n")
+    parser.add_argument('folder')
+    parser.add_argument('-g', '--ground', default="ground_truth.csv")
+    parser.add_argument('-a', '--transcript', default="hearing.txt")
+    parser.add_argument('-t', '--topics', default="topics.txt")
+    parser.add_argument('-p', '--prompt', default="0")
+    parser.add_argument('-l', '--layout', default="classic", choices=LAYOUTS)
 
-            elif prompt_type == 4: # few-shot-cot
-                file.write("EXAMPLES\n")
-                examples = Path(f"prompts/examples.txt").read_text(encoding="utf-8")
-                file.write(examples + "\n\n")
+    args = parser.parse_args()
 
-                file.write("REASONING\n")
-                reasoning = Path(f"prompts/cot.txt").read_text(encoding="utf-8")
-                file.write(reasoning + "\n\n")
-                
-            else:
-                raise Exception("Incorrect prompt type")
+    hearing = args.folder
+    path = f"hearings/{hearing}"
+    prompt_type = int(args.prompt)
 
-            file.write("OUTPUT FORMAT\n")
-            file.write(output_format + "\n\n")
+    selected = PROMPTS[1:] if prompt_type == 0 else [PROMPTS[prompt_type]]
 
-            file.write("LIST OF SPEAKERS\n")
-            speakers = ", ".join(list_of_speakers) + "\n\n"
-            file.write(speakers + "\n")
+    created = []
 
-            file.write("LIST OF TOPICS\n")
-            topics = ", ".join(list_of_topics) + "\n\n"
-            file.write(topics + "\n")
+    for prompt in selected:
+        created.append(build_prompt(path, prompt, write=True, layout=args.layout,
+                                    ground=args.ground, topics=args.topics, transcript=args.transcript))
 
-            file.write("HEARING TRANSCRIPT\n")
-            file.write(hearing_transcript)
-        
-        print(f"✓ Created {prompts[prompt_type]} prompt ({path}/{prompts[prompt_type]}.txt)")
+        print(f"✓ Created {prompt} prompt ({path}/prompts/{prompt}.txt)")
 
-        i += 1
-        prompt_type += 1
-    
\ No newline at end of file
+    if len(created) > 1:
+        shared = shared_prefix_length(created)
+        print(f"✓ Prompts share a prefix of {shared} characters ({shared / max(map(len, created)):.0%})")
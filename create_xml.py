@@ -120,6 +120,16 @@ def parse_txt_to_list(filepath):
     return lines
 
 
+def write_template(path, topics="topics.txt", output="template"):
+    """
+    Write the Label Studio config for the topics of the hearing in `path` to
+    `path/output`.xml and return it.
+    """
+    xml_config = generate_label_studio_config(parse_txt_to_list(f"{path}/{topics}"))
+    Path(f"{path}/{output}.xml").write_text(xml_config, "utf-8")
+    return xml_config
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="Create Labelling Template for Label Studio")
     
@@ -131,12 +141,9 @@ if __name__ == "__main__":
 
     hearing = args.folder
     path = f"hearings/{hearing}"
-    topics = args.topics
     output = f"{args.output}.xml"
 
-    list_of_topics = parse_txt_to_list(f"{path}/{topics}")
-    xml_config = generate_label_studio_config(list_of_topics)
-    Path(f"{path}/{output}").write_text(xml_config, "utf-8")
+    xml_config = write_template(path, args.topics, args.output)
 
     print(f"✓ Created XML labelling template for Label Studio ({path}/{output})")
 
@@ -1,11 +1,12 @@
 import argparse
-import pandas as pd
-from sklearn.metrics import accuracy_score, recall_score, f1_score, precision_score
+import csv
+
+import evaluation
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="Compare ground truth to results",
-        description="Compute metrics per speaker by transposing",
+        description="Compute metrics per topic, or per speaker",
     )
     parser.add_argument('folder')
     parser.add_argument('-g', '--ground', default="ground_truth.csv")
@@ -21,55 +22,27 @@ if __name__ == "__main__":
     rs_file  = f"{base_path}/{args.results}"
     out_csv  = f"{base_path}/{args.output}_{'speakers' if measure_speakers else 'topics'}.csv"
 
-    # Now each column is a speaker; loop over speakers exactly as you did per-topic before
-    results = {
-        'Metric': ['Accuracy', 'Precision (macro)', 'Recall (macro)', 'F1-score (macro)']
-    }
-
     print('Measuring speakers: ', measure_speakers)
 
-    if measure_speakers:
-        # Load and transpose so that speakers are columns
-        df_gt   = pd.read_csv(gt_file).set_index('Speaker').T
-        df_test = pd.read_csv(rs_file).set_index('Speaker').T
-
-        for speaker in df_gt.columns:
-            y_true = df_gt[speaker]
-            y_pred = df_test[speaker]
+    # One column per topic (or speaker), one row per metric
+    per_column = evaluation.breakdown(gt_file, rs_file, by="speaker" if measure_speakers else "topic")
 
-            acc    = accuracy_score(y_true, y_pred)
-            precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-            recall    = recall_score(y_true, y_pred, average='macro', zero_division=0)
-            f1        = f1_score(y_true, y_pred, average='macro', zero_division=0)
+    if not measure_speakers:
+        print("label_cols: ", list(per_column))
 
-            results[speaker] = [
-                f"{acc:.4f}",
-                f"{precision:.4f}",
-                f"{recall:.4f}",
-                f"{f1:.4f}"
-            ]
-    else:
-        df_gt   = pd.read_csv(gt_file)
-        df_test = pd.read_csv(rs_file)
-
-        # All columns except 'Speaker' are label columns
-        label_cols = [col for col in df_gt.columns if col != 'Speaker']
-
-        print("label_cols: ", label_cols)
-
-        for col in label_cols:
-            y_true = df_gt[col]
-            y_pred = df_test[col]
+    labels = {
+        'accuracy': 'Accuracy',
+        'precision': 'Precision (macro)',
+        'recall': 'Recall (macro)',
+        'f1': 'F1-score (macro)',
+    }
 
-            acc    = accuracy_score(y_true, y_pred)
-            recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-            precis = precision_score(y_true, y_pred, average='macro', zero_division=0)
-            f1     = f1_score(y_true, y_pred, average='macro', zero_division=0)
+    with open(out_csv, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(['Metric'] + list(per_column))
 
+        for metric, label in labels.items():
             # Format to four decimal places
-            results[col] = [f"{acc:.4f}", f"{precis:.4f}", f"{recall:.4f}", f"{f1:.4f}"]
+            writer.writerow([label] + [f"{scores[metric]:.4f}" for scores in per_column.values()])
 
-    # Build DataFrame and save
-    df_out = pd.DataFrame(results)
-    df_out.to_csv(out_csv, index=False)
     print(f"✓ Saved results to {out_csv}")
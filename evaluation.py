@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+from functools import partial
+import numpy as np
+
+from label_store import LABELS, read_table
+
+K = len(LABELS) + 1
+
+METRICS = ['accuracy', 'precision', 'recall', 'f1']
+
+MANIFEST = ".cache/eval_manifest.json"
+
+
+def align(gt, rs, by_position=False):
+    """
+    Pair ground truth and output labels. Topics are matched by name and
+    speakers by row, as in the paper; with by_position, the whole tables are
+    paired cell by cell. Returns (y_true, y_pred, topics), or None when the
+    tables cannot be paired.
+    """
+    if by_position:
+        if gt["labels"].shape != rs["labels"].shape or not gt["labels"].size:
+            return None
+        return gt["labels"], rs["labels"], gt["topics"]
+
+    if len(gt["speakers"]) != len(rs["speakers"]) or not gt["speakers"]:
+        return None
+
+    pairs = [(j, rs["topics"].index(t)) for j, t in enumerate(gt["topics"]) if t in rs["topics"]]
+    if not pairs:
+        return None
+
+    gt_cols, rs_cols = (list(c) for c in zip(*pairs))
+    return gt["labels"][:, gt_cols], rs["labels"][:, rs_cols], [gt["topics"][j] for j in gt_cols]
+
+
+def confusion(y_true, y_pred):
+    """
+    K × K confusion counts (rows: truth, columns: prediction) over the last
+    axis; leading axes are kept, e.g. (topics, speakers) → (topics, K, K).
+    """
+    y_true = np.asarray(y_true, dtype=np.intp)
+    y_pred = np.asarray(y_pred, dtype=np.intp)
+
+    cells = y_true * K + y_pred
+    lead = cells.shape[:-1]
+    cells = cells.reshape(-1, cells.shape[-1])
+
+    # Shift every slice into its own block of K * K bins
+    offsets = np.arange(len(cells))[:, None] * (K * K)
+    counts = np.bincount((cells + offsets).ravel(), minlength=len(cells) * K * K)
+
+    return counts.reshape(*lead, K, K)
+
+
+def metrics(conf):
+    """
+    Accuracy and macro precision/recall/F1 from confusion counts, for every
+    leading index of conf. Macro averages run over the labels that occur in
+    truth or prediction, with 0 for undefined ratios, matching scikit-learn
+    with zero_division=0.
+    """
+    conf = np.asarray(conf, dtype=float)
+
+    tp = np.diagonal(conf, axis1=-2, axis2=-1)
+    true = conf.sum(axis=-1)
+    pred = conf.sum(axis=-2)
+    present = (true + pred) > 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(pred > 0, tp / pred, 0.0)
+        recall = np.where(true > 0, tp / true, 0.0)
+        f1 = np.where(present, 2 * tp / (true + pred), 0.0)
+
+        n_present = present.sum(axis=-1)
+
+        return {
+            'accuracy': tp.sum(axis=-1) / conf.sum(axis=(-2, -1)),
+            'precision': np.where(present, precision, 0).sum(axis=-1) / n_present,
+            'recall': np.where(present, recall, 0).sum(axis=-1) / n_present,
+            'f1': np.where(present, f1, 0).sum(axis=-1) / n_present,
+        }
+
+
+def scores(conf):
+    """
+    metrics() of a single confusion matrix as plain floats.
+    """
+    return {metric: float(value) for metric, value in metrics(conf).items()}
+
+
+def evaluate_file(gt_path, rs_path, by_position=False):
+    """
+    Confusion matrix of one output CSV against its ground truth, or None.
+    """
+    pair = align(read_table(gt_path), read_table(rs_path), by_position)
+    if pair is None:
+        return None
+
+    y_true, y_pred, _ = pair
+    return confusion(y_true.ravel(), y_pred.ravel())
+
+
+def breakdown(gt_path, rs_path, by="topic"):
+    """
+    Metrics per topic or per speaker, as {name: scores}.
+    """
+    gt = read_table(gt_path)
+    pair = align(gt, read_table(rs_path))
+    if pair is None:
+        raise ValueError(f"{rs_path} does not match the rows of {gt_path}")
+
+    y_true, y_pred, topics = pair
+
+    if by == "topic":
+        names, conf = topics, confusion(y_true.T, y_pred.T)
+    else:
+        names, conf = gt["speakers"], confusion(y_true, y_pred)
+
+    per_name = metrics(conf)
+    return {name: {m: float(per_name[m][i]) for m in METRICS} for i, name in enumerate(names)}
+
+
+def pool(confusions, how="macro"):
+    """
+    Combine several files: "micro" sums the confusion counts first, "macro"
+    averages the per-file metrics.
+    """
+    if how == "micro":
+        return scores(np.sum(confusions, axis=0))
+
+    per_file = [scores(conf) for conf in confusions]
+    return {m: sum(s[m] for s in per_file) / len(per_file) for m in METRICS}
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(path=MANIFEST):
+    """
+    Per-file content hashes and confusion matrices of earlier runs, as
+    {output path: entry}. A missing or broken manifest is an empty one.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Drop outputs that were deleted since they were evaluated
+    manifest = {rs: entry for rs, entry in manifest.items() if os.path.isfile(rs)}
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cached_confusion(gt_path, rs_path, by_position=False, entry=None):
+    """
+    evaluate_file() through a manifest entry. The entry is reused when both
+    files still have the hashes it was computed for. Returns (conf, entry,
+    hit), where entry is the up-to-date entry to store for rs_path.
+    """
+    hashes = {"ground_truth": file_hash(gt_path), "output": file_hash(rs_path)}
+    mode = "speakers" if by_position else "topics"
+
+    if entry is None or any(entry.get(k) != v for k, v in hashes.items()):
+        entry = hashes
+    elif mode in entry:
+        conf = entry[mode]
+        return (None if conf is None else np.array(conf)), entry, True
+
+    conf = evaluate_file(gt_path, rs_path, by_position)
+    entry = {**entry, mode: None if conf is None else conf.tolist()}
+    return conf, entry, False
+
+
+def evaluate_hearing(hearing_path, models, prompt_files, by_position=False, manifest=None):
+    """
+    Confusion matrices of every model/prompt output of one hearing, as
+    {(model, prompt_file): conf}. Outputs that cannot be paired are left out.
+
+    With a manifest (see load_manifest), unchanged files are not evaluated
+    again. Returns (confusions, entries, evaluated), where entries are the
+    new manifest entries of this hearing's outputs and evaluated is the
+    number of files that were actually compared.
+    """
+    gt_file = os.path.join(hearing_path, "ground_truth.csv")
+    confusions, entries, evaluated = {}, {}, 0
+
+    for model in models:
+        for prompt_file in prompt_files:
+            result_path = os.path.join(hearing_path, "output", model, prompt_file)
+            if not os.path.isfile(result_path):
+                continue
+
+            try:
+                if manifest is None:
+                    conf = evaluate_file(gt_file, result_path, by_position)
+                    evaluated += 1
+                else:
+                    conf, entries[result_path], hit = cached_confusion(
+                        gt_file, result_path, by_position, manifest.get(result_path)
+                    )
+                    evaluated += not hit
+            except Exception as e:
+                print(f"⚠ Error comparing {result_path}: {e}")
+                continue
+
+            if conf is not None:
+                confusions[(model, prompt_file)] = conf
+
+    return confusions, entries, evaluated
+
+
+def evaluate_corpus(base_dir, models, prompt_files, by_position=False, jobs=1, manifest=None):
+    """
+    evaluate_hearing() for every hearing with a ground truth, in sorted order.
+    With jobs > 1 the hearings are spread over a process pool; the result is
+    the same list either way.
+
+    A manifest dict is updated in place with the entries of all evaluated
+    outputs, so that it can be saved for the next run.
+    """
+    hearings = sorted(
+        h for h in os.listdir(base_dir)
+        if os.path.isfile(os.path.join(base_dir, h, "ground_truth.csv"))
+    )
+    paths = [os.path.join(base_dir, h) for h in hearings]
+    work = partial(evaluate_hearing, models=models, prompt_files=prompt_files, by_position=by_position)
+
+    # Every worker only gets the entries of its own hearing
+    if manifest is None:
+        shares = [None] * len(paths)
+    else:
+        shares = [
+            {rs: entry for rs, entry in manifest.items() if rs.startswith(os.path.join(path, ""))}
+            for path in paths
+        ]
+
+    if jobs > 1:
+        # Imported here: single-process runs do not pay for multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(partial(_evaluate_share, work), paths, shares))
+    else:
+        results = [_evaluate_share(work, path, share) for path, share in zip(paths, shares)]
+
+    if manifest is not None:
+        for _, entries, _ in results:
+            manifest.update(entries)
+
+        evaluated = sum(n for _, _, n in results)
+        print(f"✓ Evaluated {evaluated} new or changed files, reused the rest from the manifest")
+
+    return [(hearing, confusions) for hearing, (confusions, _, _) in zip(hearings, results)]
+
+
+def _evaluate_share(work, path, share):
+    return work(path, manifest=share)
@@ -1,41 +1,97 @@
 import argparse
-import pandas as pd
+import csv
+import os
+import numpy as np
 
+from agreement import annotator_files
+from label_store import CODES, LABELS, OTHER, read_table
 
-def create_ground_truth(file1: str, file2: str, output_file: str):
-    df1 = pd.read_csv(file1, index_col=0)
-    df2 = pd.read_csv(file2, index_col=0)
+POLICIES = ["x", "unanimous", "majority"]
 
-    if not df1.columns.equals(df2.columns) or not df1.index.equals(df2.index):
-        raise ValueError("CSV files must have matching rows and columns")
+# Cells the annotators could not agree on are written as 'x'
+VALUES = np.array(LABELS + ["x"])
 
-    ground_truth = df1.copy()
 
-    for col in df1.columns:
-        for idx in df1.index:
-            val1 = df1.at[idx, col]
-            val2 = df2.at[idx, col]
-            ground_truth.at[idx, col] = val1 if val1 == val2 else "x"
+def merge_labels(labels, policy="x"):
+    """
+    Merge annotator labels (annotators × speakers × topics) into one table:
+    unanimous cells keep their label, the others become 'x' ("x"), neutral
+    ("unanimous"), or the label of a strict majority, else 'x' ("majority").
+    """
+    labels = np.asarray(labels)
+    agree = (labels == labels[0]).all(axis=0)
 
-    ground_truth.to_csv(output_file)
+    if policy == "x":
+        return np.where(agree, labels[0], OTHER)
+
+    if policy == "unanimous":
+        return np.where(agree, labels[0], CODES["0"])
+
+    counts = (labels[..., None] == np.arange(len(LABELS))).sum(axis=0)
+    winner = counts.argmax(axis=-1)
+    return np.where(counts.max(axis=-1) * 2 > len(labels), winner, OTHER)
+
+
+def create_ground_truth(files, output_file, policy="x"):
+    tables = [read_table(f) for f in files]
+    first = tables[0]
+
+    for table in tables[1:]:
+        if table["speakers"] != first["speakers"] or table["topics"] != first["topics"]:
+            raise ValueError("CSV files must have matching rows and columns")
+
+    with open(files[0], "r", newline="", encoding="utf-8-sig") as f:
+        corner = next(csv.reader(f))[0]
+
+    merged = VALUES[merge_labels([t["labels"] for t in tables], policy)]
+
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow([corner] + first["topics"])
+        writer.writerows([speaker] + list(row) for speaker, row in zip(first["speakers"], merged))
+
+    return int((merged == "x").sum())
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="Create ground truth")
-    
-    parser.add_argument('folder')
+
+    parser.add_argument('folder', nargs='?')
     parser.add_argument('-a', '--alpha', default="ground_truth_1.csv")
     parser.add_argument('-b', '--beta', default="ground_truth_2.csv")
+    parser.add_argument('-i', '--inputs', nargs='+', help="Any number of annotator CSVs (instead of --alpha and --beta)")
     parser.add_argument('-o', '--output', default="ground_truth.csv")
+    parser.add_argument('-p', '--policy', default="x", choices=POLICIES, help="How to resolve disagreements")
+    parser.add_argument('--all', action='store_true', help="Merge the ground_truth_<n>.csv files of every hearing")
+    parser.add_argument('--overwrite', action='store_true', help="With --all, replace existing outputs")
 
     args = parser.parse_args()
 
-    hearing = args.folder
-    path = f"hearings/{hearing}"
+    base_dir = "hearings"
+
+    if args.all:
+        jobs = []
+        for hearing in sorted(os.listdir(base_dir)):
+            path = f"{base_dir}/{hearing}"
+            if not os.path.isdir(path):
+                continue
+
+            files = annotator_files(path, "ground_truth_", ".csv")
+            if len(files) < 2:
+                continue
 
-    gt_1 = args.alpha
-    gt_2 = args.beta
+            if os.path.isfile(f"{path}/{args.output}") and not args.overwrite:
+                print(f"⏭ {hearing}: {args.output} exists, skipping (use --overwrite)")
+                continue
 
-    output = f"{args.output}"
+            jobs.append((files, f"{path}/{args.output}"))
+    elif args.folder:
+        path = f"{base_dir}/{args.folder}"
+        inputs = args.inputs or [args.alpha, args.beta]
+        jobs = [([f"{path}/{f}" for f in inputs], f"{path}/{args.output}")]
+    else:
+        parser.error("give a hearing folder or --all")
 
-    create_ground_truth(f"{path}/{gt_1}", f"{path}/{gt_2}", f"{path}/{output}")
+    for files, output in jobs:
+        unresolved = create_ground_truth(files, output, args.policy)
+        print(f"✓ Merged {len(files)} annotators into {output} ({unresolved} cells marked x)")
@@ -0,0 +1,178 @@
+import argparse
+import csv
+import os
+from functools import lru_cache
+import numpy as np
+
+LABELS = ["-1", "0", "1"]
+CODES = {label: i for i, label in enumerate(LABELS)}
+
+# Anything that is not a valid label (a typo, 'x', an empty cell) goes into
+# one extra bucket, so that confusion matrices are K × K with K = 4
+OTHER = len(LABELS)
+
+STORE = "hearings/labels.npz"
+
+
+def parse_table(path):
+    """
+    Read a speaker × topic CSV (ground truth or model output) into label codes.
+    """
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        rows = [row for row in csv.reader(f) if row]
+
+    topics = rows[0][1:] if rows else []
+    speakers = [row[0] for row in rows[1:]]
+    labels = np.full((len(speakers), len(topics)), OTHER, dtype=np.int8)
+
+    for i, row in enumerate(rows[1:]):
+        for j, value in enumerate(row[1:len(topics) + 1]):
+            labels[i, j] = CODES.get(value.strip(), OTHER)
+
+    return {"speakers": speakers, "topics": topics, "labels": labels}
+
+
+def label_files(base_dir="hearings"):
+    """
+    Every label table of the corpus as (hearing, source, path), where source
+    is the path within the hearing without '.csv', e.g. 'ground_truth_1' or
+    'output/o3/few_shot'.
+    """
+    for hearing in sorted(os.listdir(base_dir)):
+        path = os.path.join(base_dir, hearing)
+        if not os.path.isdir(path):
+            continue
+
+        sources = [f[:-4] for f in sorted(os.listdir(path)) if f.startswith("ground_truth") and f.endswith(".csv")]
+
+        output = os.path.join(path, "output")
+        for model in sorted(os.listdir(output)) if os.path.isdir(output) else []:
+            model_dir = os.path.join(output, model)
+            if os.path.isdir(model_dir):
+                sources += [f"output/{model}/{f[:-4]}" for f in sorted(os.listdir(model_dir)) if f.endswith(".csv")]
+
+        for source in sources:
+            yield hearing, source, os.path.join(path, f"{source}.csv")
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _flatten(lists, dictionary):
+    """
+    Concatenate lists of strings as ids into a shared dictionary, with offsets.
+    """
+    ids = {s: i for i, s in enumerate(dictionary)}
+    flat = np.array([ids[s] for strings in lists for s in strings], dtype=np.int32)
+    offsets = np.cumsum([0] + [len(strings) for strings in lists], dtype=np.int64)
+    return flat, offsets
+
+
+def compile_store(base_dir="hearings", store=STORE):
+    """
+    Pack every label table of the corpus into one .npz file: a flat int8
+    array of all labels, speaker and topic ids into string dictionaries, and
+    offsets into both per table. Returns the number of tables.
+    """
+    entries = list(label_files(base_dir))
+    tables = [parse_table(path) for _, _, path in entries]
+
+    hearings = sorted({h for h, _, _ in entries})
+    sources = sorted({s for _, s, _ in entries})
+    speakers = sorted({sp for t in tables for sp in t["speakers"]})
+    topics = sorted({tp for t in tables for tp in t["topics"]})
+
+    speaker_ids, speaker_offsets = _flatten([t["speakers"] for t in tables], speakers)
+    topic_ids, topic_offsets = _flatten([t["topics"] for t in tables], topics)
+
+    np.savez(
+        store,
+        # Paths are relative to the folder of the store
+        files=np.array([os.path.relpath(path, os.path.dirname(store)) for _, _, path in entries], dtype=str),
+        stamps=np.array([_stamp(path) for _, _, path in entries], dtype=np.int64).reshape(-1, 2),
+        hearings=np.array(hearings, dtype=str),
+        sources=np.array(sources, dtype=str),
+        hearing_ids=np.array([hearings.index(h) for h, _, _ in entries], dtype=np.int32),
+        source_ids=np.array([sources.index(s) for _, s, _ in entries], dtype=np.int32),
+        speakers=np.array(speakers, dtype=str),
+        topics=np.array(topics, dtype=str),
+        speaker_ids=speaker_ids,
+        speaker_offsets=speaker_offsets,
+        topic_ids=topic_ids,
+        topic_offsets=topic_offsets,
+        labels=np.concatenate([t["labels"].ravel() for t in tables] or [np.zeros(0, dtype=np.int8)]),
+        label_offsets=np.cumsum([0] + [t["labels"].size for t in tables], dtype=np.int64),
+    )
+
+    return len(tables)
+
+
+@lru_cache(maxsize=4)
+def load_store(store=STORE, version=None):
+    """
+    All arrays of a store, plus an index from file path to table number.
+    version (the store's mtime) only serves to reload a recompiled store.
+    """
+    with np.load(store, allow_pickle=False) as npz:
+        data = {key: npz[key] for key in npz.files}
+
+    data["index"] = {path: i for i, path in enumerate(data["files"].tolist())}
+    return data
+
+
+def get_table(data, i):
+    """
+    Table number i of a loaded store, in the format of parse_table().
+    """
+    sp = slice(*data["speaker_offsets"][i:i + 2])
+    tp = slice(*data["topic_offsets"][i:i + 2])
+
+    speakers = data["speakers"][data["speaker_ids"][sp]].tolist()
+    topics = data["topics"][data["topic_ids"][tp]].tolist()
+    labels = data["labels"][slice(*data["label_offsets"][i:i + 2])].reshape(len(speakers), len(topics))
+
+    return {"speakers": speakers, "topics": topics, "labels": labels}
+
+
+def iter_tables(store=STORE, hearing=None, source=None):
+    """
+    Yield (hearing, source, table) for every table of a store, optionally
+    only those of one hearing or one source.
+    """
+    data = load_store(store, os.stat(store).st_mtime_ns)
+
+    for i in range(len(data["files"])):
+        h = data["hearings"][data["hearing_ids"][i]]
+        s = data["sources"][data["source_ids"][i]]
+
+        if (hearing is None or h == hearing) and (source is None or s == source):
+            yield str(h), str(s), get_table(data, i)
+
+
+def read_table(path, store=STORE):
+    """
+    parse_table() through the store: tables are taken from the store when it
+    contains them and the CSV did not change since it was compiled.
+    """
+    if store and os.path.isfile(store):
+        data = load_store(store, os.stat(store).st_mtime_ns)
+        i = data["index"].get(os.path.relpath(path, os.path.dirname(store)))
+
+        if i is not None and os.path.isfile(path) and _stamp(path) == tuple(data["stamps"][i]):
+            return get_table(data, i)
+
+    return parse_table(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Compile all label CSVs into one array store")
+
+    parser.add_argument('-d', '--base-dir', default="hearings")
+    parser.add_argument('-o', '--output', default=STORE)
+
+    args = parser.parse_args()
+
+    n = compile_store(args.base_dir, args.output)
+    print(f"✓ Packed {n} tables into {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
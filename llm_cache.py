@@ -0,0 +1,117 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+CACHE_DIR = ".cache/llm"
+
+
+def cache_key(model: str, prompt: str, params: dict | None = None) -> str:
+    """
+    Content address of a request: identical model, prompt text and request
+    parameters always map to the same key.
+    """
+    payload = json.dumps(
+        {"model": model, "input": prompt, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def load(key: str, cache_dir: str = CACHE_DIR, max_age: float | None = None) -> dict | None:
+    """
+    Return the cached record for a key, or None on a miss. Entries older than
+    max_age seconds count as misses.
+    """
+    path = _entry_path(key, cache_dir)
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if max_age is not None and time.time() - record.get("created", 0) > max_age:
+        return None
+
+    # The modification time doubles as the last access time for eviction
+    os.utime(path)
+    return record
+
+
+def store(key: str, record: dict, cache_dir: str = CACHE_DIR):
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    record = {"created": time.time(), **record}
+
+    # Write to a temporary file first so concurrent readers never see half an entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def make_record(model: str, params: dict | None, response) -> dict:
+    return {
+        "model": model,
+        "params": params or {},
+        "output_text": response.output_text,
+        "response": response.model_dump(mode="json"),
+    }
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int | None = None, max_age: float | None = None):
+    """
+    Remove entries that were not used for max_age seconds, then remove the least
+    recently used entries until the cache is at most max_bytes. Returns (files, bytes) removed.
+    """
+    entries = []
+
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+
+    entries.sort()  # least recently used first
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed_files, removed_bytes = 0, 0
+
+    for mtime, size, path in entries:
+        too_old = max_age is not None and now - mtime > max_age
+        too_big = max_bytes is not None and total > max_bytes
+
+        if not (too_old or too_big):
+            continue
+
+        os.remove(path)
+        total -= size
+        removed_files += 1
+        removed_bytes += size
+
+    return removed_files, removed_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Evict entries from the LLM response cache")
+
+    parser.add_argument('-d', '--dir', default=CACHE_DIR)
+    parser.add_argument('-s', '--max-size', type=float, help="Maximum cache size in MB")
+    parser.add_argument('-a', '--max-age', type=float, help="Maximum entry age in days")
+
+    args = parser.parse_args()
+
+    max_bytes = int(args.max_size * 1024 * 1024) if args.max_size is not None else None
+    max_age = args.max_age * 24 * 60 * 60 if args.max_age is not None else None
+
+    files, size = evict(args.dir, max_bytes, max_age)
+
+    print(f"✓ Evicted {files} entries ({size / 1024 / 1024:.1f} MB) from {args.dir}")
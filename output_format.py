@@ -0,0 +1,137 @@
+import csv
+
+from label_store import CODES
+
+
+class OutputFormatError(ValueError):
+    """
+    The model output is not (or no longer) the CSV table the prompt asks for.
+    """
+
+
+# The validator is a dict so it can be fed from sync and async streams alike:
+#
+#     validator = new_validator(speakers, topics)
+#     for delta in stream:
+#         rows = feed_validator(validator, delta)     # complete, valid lines
+#     rows, missing = finish_validator(validator)
+#
+# Rows must name a known speaker, in the order of the ground truth (speakers
+# may be left out, but not repeated or reordered, since the evaluation pairs
+# speakers by row), and have a -1, 0 or 1 for every topic. The header names
+# every topic once, in any order (validator["header"] keeps the order used).
+# Code fences around the table are allowed, anything else raises
+# OutputFormatError at once.
+
+def new_validator(speakers, topics):
+    header = ",".join(["Speaker"] + list(topics))
+
+    return {
+        "speakers": {speaker: i for i, speaker in enumerate(speakers)},
+        "topics": list(topics),
+        # A line this long without a newline is prose, not a table row
+        "max_line": 2 * len(header) + 100,
+        "buffer": "",
+        "header": None,
+        "last": -1,
+        "seen": [],
+        "closed": False,
+    }
+
+
+def _check_line(validator, line):
+    """
+    Validate one complete line and return it, or None when it is not part of
+    the table (blank lines, code fences).
+    """
+    stripped = line.strip()
+
+    if not stripped:
+        return None
+
+    if stripped.startswith("```"):
+        # The opening fence comes before the header, the closing one ends the table
+        validator["closed"] = validator["header"] is not None
+        return None
+
+    if validator["closed"]:
+        raise OutputFormatError(f"text after the table: {stripped[:60]!r}")
+
+    cells = [cell.strip() for cell in next(csv.reader([stripped]))]
+    topics = validator["topics"]
+
+    if validator["header"] is None:
+        # The evaluation finds topics by name, so any column order will do
+        if len(cells) != len(topics) + 1 or sorted(cells[1:]) != sorted(topics):
+            raise OutputFormatError(f"expected a header with the topics, got {stripped[:60]!r}")
+        validator["header"] = cells
+        return stripped
+
+    if len(cells) != len(topics) + 1:
+        raise OutputFormatError(f"expected {len(topics) + 1} cells, got {len(cells)}: {stripped[:60]!r}")
+
+    speaker = cells[0]
+    if speaker not in validator["speakers"]:
+        raise OutputFormatError(f"unknown speaker {speaker!r}")
+
+    position = validator["speakers"][speaker]
+    if position <= validator["last"]:
+        raise OutputFormatError(f"{speaker!r} is repeated or out of order")
+
+    invalid = [value for value in cells[1:] if value not in CODES]
+    if invalid:
+        raise OutputFormatError(f"invalid label {invalid[0]!r} for {speaker!r}")
+
+    validator["last"] = position
+    validator["seen"].append(speaker)
+    return stripped
+
+
+def feed_validator(validator, text):
+    """
+    Add streamed text and return the lines of the table it completed.
+    """
+    validator["buffer"] += text
+    *lines, validator["buffer"] = validator["buffer"].split("\n")
+
+    if len(validator["buffer"]) > validator["max_line"]:
+        raise OutputFormatError(f"no line break after {len(validator['buffer'])} characters")
+
+    return [row for row in (_check_line(validator, line) for line in lines) if row is not None]
+
+
+def finish_validator(validator):
+    """
+    Validate the last line once the stream ended. Returns (rows, missing),
+    with missing the expected speakers that have no row.
+    """
+    last = _check_line(validator, validator["buffer"])
+    validator["buffer"] = ""
+
+    if validator["header"] is None:
+        raise OutputFormatError("the output has no table")
+
+    seen = set(validator["seen"])
+    missing = [speaker for speaker in validator["speakers"] if speaker not in seen]
+    return ([] if last is None else [last]), missing
+
+
+def validate_output(text, speakers, topics):
+    """
+    Validate a complete output at once. Returns (rows, missing).
+    """
+    validator = new_validator(speakers, topics)
+    rows = feed_validator(validator, text)
+    last, missing = finish_validator(validator)
+    return rows + last, missing
+
+
+def check_record(record, speakers, topics):
+    """
+    Raise OutputFormatError unless a cached response is a valid table.
+    Records stored with an "invalid" reason (an accepted last attempt that
+    was off-format) never pass.
+    """
+    if record.get("invalid"):
+        raise OutputFormatError(record["invalid"])
+    validate_output(record["output_text"], speakers, topics)
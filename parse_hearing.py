@@ -1,6 +1,12 @@
 import argparse
+import mmap
+import os
 import re, json, textwrap
-from pathlib import Path
+from functools import lru_cache
+from typing import IO, Iterable, Iterator
+import numpy as np
+
+from create_ground_truth import segment_speaker
 
 # ----------------------------------------------------------------------
 # tune this list if your corpus contains other titles
@@ -24,65 +30,256 @@ SPEAKER_LINE = re.compile(
 )
 
 
-def parse_hearing(raw: str) -> list[str]:
+def iter_turns(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
     """
-    Turn a congressional-hearing transcript into
-    ['<Speaker> <utterance>'], preserving paragraph breaks:
+    Turn the lines of a congressional-hearing transcript into
+    (speaker, utterance) turns, yielded as soon as the next speaker starts.
+    Accepts any iterable of lines, such as an open file:
     - Lines within the same paragraph are joined with spaces.
-    - Paragraphs start on lines indented by 4 spaces; those get separated by '\n'.
+    - Paragraphs start on lines indented by 4 spaces; those get separated by '\n\n'.
+    - Lines before the first speaker are kept as the start of that speaker's turn.
+    Only the paragraphs of the current speaker are kept in memory.
     """
-    lines = textwrap.dedent(raw).splitlines()
-    data: list[str] = []
-    buf: list[str] = []
     speaker = None
-
-    def flush():
-        nonlocal buf, speaker, data
-        if speaker and buf:
-            paragraphs: list[str] = []
-            current_para = None
-
-            for line in buf:
-                # If a line begins with 4 spaces, treat it as a new paragraph
-                if line.startswith("    "):
-                    # Save the previous paragraph (if any)
-                    if current_para is not None:
-                        paragraphs.append(current_para)
-                    # Start a new paragraph, stripping that indent
-                    current_para = line.lstrip()
-                else:
-                    # Continuation of the current paragraph (or first paragraph)
-                    if current_para is None:
-                        current_para = line
-                    else:
-                        # Join with a space, collapsing internal newlines
-                        current_para += " " + line.strip()
-
-            # Append the very last paragraph
-            if current_para is not None:
-                paragraphs.append(current_para)
-
-            # Join paragraphs with a newline between them
-            combined = "\n\n".join(p for p in paragraphs if p.strip())
-            data.append(f"{speaker} {combined}")
-            buf.clear()
+    paragraphs: list[str] = []
+    current: list[str] | None = None    # pieces of the paragraph being built
+    has_lines = False
 
     for ln in lines:
         m = SPEAKER_LINE.match(ln)
         if m:
-            # New speaker → flush old buffer
-            flush()
+            # New speaker → emit the previous one
+            if speaker is not None:
+                if has_lines:
+                    yield speaker, _utterance(paragraphs, current)
+                paragraphs, current, has_lines = [], None, False
+
             speaker = m["who"]
-            first_chunk = m["rest"].strip()
-            if first_chunk:
-                buf.append(first_chunk)
+            ln = m["rest"].strip()
+            if not ln:
+                continue
         else:
             # Preserve leading spaces so we can detect paragraph indents
-            buf.append(ln.rstrip())
+            ln = ln.rstrip()
+
+        has_lines = True
+
+        # If a line begins with 4 spaces, treat it as a new paragraph
+        if ln.startswith("    "):
+            if current is not None:
+                paragraphs.append(" ".join(current))
+            current = [ln.lstrip()]
+        elif current is None:
+            # First line of the paragraph
+            current = [ln]
+        else:
+            # Continuation of the current paragraph, collapsing internal newlines
+            current.append(ln.strip())
+
+    # Emit the final speaker block
+    if speaker is not None and has_lines:
+        yield speaker, _utterance(paragraphs, current)
+
+
+def _utterance(paragraphs: list[str], current: list[str] | None) -> str:
+    if current is not None:
+        paragraphs = paragraphs + [" ".join(current)]
+
+    # Join paragraphs with a blank line between them
+    return "\n\n".join(p for p in paragraphs if p.strip())
+
+
+def iter_segments(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Like iter_turns, but as '<Speaker> <utterance>' segments for Label Studio.
+    """
+    for speaker, utterance in iter_turns(lines):
+        yield f"{speaker} {utterance}"
+
+
+def dedent_file(fp: IO[str]) -> Iterator[str]:
+    """
+    The lines of a text file without the indent they all share, like
+    textwrap.dedent(), but reading the file twice instead of holding it in
+    memory.
+    """
+    margin = None
+    for ln in fp:
+        if ln.strip():
+            indent = ln[:len(ln) - len(ln.lstrip(" \t"))]
+            margin = indent if margin is None else os.path.commonprefix([margin, indent])
+
+    fp.seek(0)
+    for ln in fp:
+        yield ln[len(margin or ""):] if ln.strip() else ln.lstrip(" \t")
+
 
-    # Flush the final speaker block
-    flush()
-    return data
+def parse_hearing(raw: str) -> list[str]:
+    """
+    Segment a whole transcript held in memory. See iter_turns.
+    """
+    return list(iter_segments(textwrap.dedent(raw).splitlines()))
+
+
+def write_tasks(segments: Iterable[str], fp: IO[str]) -> int:
+    """
+    Write segments as a Label Studio JSON array, one task at a time. The
+    result is identical to json.dumps(tasks, indent=2). Returns the task count.
+    """
+    count = 0
+    fp.write("[")
+
+    for count, segment in enumerate(segments, start=1):
+        task = json.dumps({"id": count, "text": segment}, indent=2)
+        fp.write(",\n" if count > 1 else "\n")
+        fp.write(textwrap.indent(task, "  "))
+
+    fp.write("\n]" if count else "]")
+    return count
+
+
+def write_ndjson(segments: Iterable[str], fp: IO[bytes]) -> tuple[list[int], list[str]]:
+    """
+    Write segments as one {"id", "speaker", "text"} JSON object per line to a
+    binary file. Returns the byte offset of every line (plus the end of the
+    file) and the speaker of every segment, for write_index().
+    """
+    offsets, speakers = [0], []
+
+    for i, segment in enumerate(segments, start=1):
+        speaker = segment_speaker(segment)
+        line = json.dumps({"id": i, "speaker": speaker, "text": segment}, ensure_ascii=False) + "\n"
+        data = line.encode("utf-8")
+
+        fp.write(data)
+        offsets.append(offsets[-1] + len(data))
+        speakers.append(speaker)
+
+    return offsets, speakers
+
+
+def write_index(offsets: list[int], speakers: list[str], path: str | IO[bytes]):
+    """
+    Save the line offsets of an NDJSON segment file together with a speaker
+    index: the segments of every speaker are a contiguous run of by_speaker.
+    """
+    names = list(dict.fromkeys(speakers))
+    codes = {name: i for i, name in enumerate(names)}
+    speaker_ids = np.array([codes[sp] for sp in speakers], dtype=np.int32)
+
+    np.savez(
+        path,
+        offsets=np.array(offsets, dtype=np.int64),
+        speakers=np.array(names, dtype=str),
+        speaker_ids=speaker_ids,
+        by_speaker=np.argsort(speaker_ids, kind="stable").astype(np.int32),
+        speaker_offsets=np.cumsum([0] + np.bincount(speaker_ids, minlength=len(names)).tolist(), dtype=np.int64),
+    )
+
+
+@lru_cache(maxsize=16)
+def open_segments(path: str, ndjson: str = "hearing.ndjson", index: str = "hearing.idx.npz") -> dict:
+    """
+    Memory-map the NDJSON segments of a hearing folder and load their index.
+    """
+    with open(f"{path}/{ndjson}", "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if f.seek(0, 2) else b""
+
+    with np.load(f"{path}/{index}", allow_pickle=False) as npz:
+        store = {key: npz[key] for key in npz.files}
+
+    store["data"] = data
+    store["codes"] = {name: i for i, name in enumerate(store["speakers"].tolist())}
+    return store
+
+
+def get_segment(store: dict, segment_id: int) -> dict:
+    """
+    One segment by its id (1-based), without reading any other.
+    """
+    start, end = store["offsets"][segment_id - 1:segment_id + 1]
+    return json.loads(store["data"][start:end])
+
+
+def get_segments(store: dict, first: int, last: int) -> list[dict]:
+    """
+    Segments first..last (ids, inclusive), e.g. get_segments(store, 120, 180).
+    """
+    first, last = max(first, 1), min(last, len(store["offsets"]) - 1)
+    if first > last:
+        return []
+
+    start, end = store["offsets"][first - 1], store["offsets"][last]
+    return [json.loads(line) for line in store["data"][start:end].splitlines()]
+
+
+def speaker_segments(store: dict, speaker: str) -> list[dict]:
+    """
+    All segments of one speaker (as in the ground truth, e.g. "Ms. Stansbury"), in order.
+    """
+    code = store["codes"].get(speaker)
+    if code is None:
+        return []
+
+    run = store["by_speaker"][store["speaker_offsets"][code]:store["speaker_offsets"][code + 1]]
+    return [get_segment(store, i + 1) for i in run]
+
+
+def parse_file(path: str, hearing: str = "hearing.txt", output: str = "hearing") -> list[str]:
+    """
+    Parse `path/hearing` into `output`.ndjson, its index `output`.idx.npz and
+    the Label Studio tasks `output`.json. Returns the speaker of every segment.
+    """
+    # Everything is written next to the old files and swapped in at the end:
+    # open_segments() may hold a memory map of the old NDJSON, which must not
+    # change (or shrink) under it
+    ndjson, index, tasks = (f"{path}/{output}{ext}" for ext in (".ndjson", ".idx.npz", ".json"))
+    tmp = f".{os.getpid()}.tmp"
+
+    # Stream from the transcript into the NDJSON segments and their index ...
+    with open(f"{path}/{hearing}", "r", encoding="utf-8") as src, \
+         open(f"{ndjson}{tmp}", "wb") as dst:
+        offsets, speakers = write_ndjson(iter_segments(dedent_file(src)), dst)
+
+    # (a file object, since np.savez would add .npz to the name)
+    with open(f"{index}{tmp}", "wb") as dst:
+        write_index(offsets, speakers, dst)
+
+    # ... and from there into the JSON array for Label Studio
+    with open(f"{ndjson}{tmp}", "r", encoding="utf-8") as src, \
+         open(f"{tasks}{tmp}", "w", encoding="utf-8") as dst:
+        write_tasks((json.loads(line)["text"] for line in src), dst)
+
+    for file in (ndjson, index, tasks):
+        os.replace(f"{file}{tmp}", file)
+    open_segments.cache_clear()
+
+    return speakers
+
+
+def index_tasks(path: str, tasks: str = "hearing.json", output: str = "hearing") -> list[str]:
+    """
+    Build `output`.ndjson and its index from the Label Studio tasks
+    `path/tasks` instead of the transcript, so the segments stay the ones
+    that were annotated. Returns the speaker of every segment.
+    """
+    ndjson, index = (f"{path}/{output}{ext}" for ext in (".ndjson", ".idx.npz"))
+    tmp = f".{os.getpid()}.tmp"
+
+    with open(f"{path}/{tasks}", "r", encoding="utf-8") as f:
+        segments = [task["text"] for task in json.load(f)]
+
+    with open(f"{ndjson}{tmp}", "wb") as dst:
+        offsets, speakers = write_ndjson(segments, dst)
+
+    with open(f"{index}{tmp}", "wb") as dst:
+        write_index(offsets, speakers, dst)
+
+    for file in (ndjson, index):
+        os.replace(f"{file}{tmp}", file)
+    open_segments.cache_clear()
+
+    return speakers
 
 
 if __name__ == "__main__":
@@ -96,18 +293,9 @@ if __name__ == "__main__":
 
     folder = args.folder
     path = f"hearings/{folder}"
-    hearing = args.hearing
-    output = f"{args.output}.json"
-
-    text = Path(f"{path}/{hearing}").read_text(encoding="utf-8")
-    list_of_segments = parse_hearing(text)
-
-    tasks = [
-        {"id": i + 1, "text": segment}
-        for i, segment in enumerate(list_of_segments)
-    ]
 
-    # JSON array
-    Path(f"{path}/{output}").write_text(json.dumps(tasks, indent=2), "utf-8")
+    speakers = parse_file(path, args.hearing, args.output)
 
-    print(f"✓ Ready for Label Studio ({path}/{output})")
+    print(f"✓ Ready for Label Studio ({path}/{args.output}.json)")
+    print(f"✓ Indexed {len(speakers)} segments of {len(set(speakers))} speakers "
+          f"({path}/{args.output}.ndjson, {path}/{args.output}.idx.npz)")
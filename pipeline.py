@@ -0,0 +1,397 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import evaluate_all_hearings
+import run_grid
+from agreement import annotator_files
+from create_ground_truth import ground_truth_from_export
+from create_prompt import LAYOUTS, SECTIONS, build_prompt
+from create_xml import write_template
+from find_differences import POLICIES, create_ground_truth
+from parse_hearing import index_tasks, parse_file
+
+STAMPS = ".cache/pipeline.json"
+
+STAGES = ["parse", "index", "template", "ground_truth", "merge", "prompt", "call", "evaluate"]
+
+
+# ----------------------------------------------------------------------
+# Stages
+#
+# A stage is a dict with a unique "id", the "stage" it belongs to, its
+# "inputs" and "outputs" (file paths), the "params" that change its result
+# besides the inputs, and the "action" that makes the outputs. Inputs listed
+# under "optional" may be missing. Stages marked "edited" have outputs that
+# are meant to be edited by hand afterwards, such as the adjudicated ground
+# truth, and are not overwritten once they were. Stages marked "annotated"
+# have outputs that annotations refer to, such as the segments of
+# hearing.json: once they exist, they are only rewritten with --force.
+
+def hearing_stages(base_dir, hearing, models=run_grid.MODELS, prompts=run_grid.PROMPTS, layout="classic",
+                   policy="x"):
+    """
+    The stages of one hearing, from its transcript, topics and Label Studio
+    exports to the model outputs of every prompt variant.
+    """
+    path = f"{base_dir}/{hearing}"
+    stages = [
+        {
+            "id": f"{hearing}:parse",
+            "stage": "parse",
+            "inputs": [f"{path}/hearing.txt"],
+            "outputs": [f"{path}/hearing.json"],
+            "params": {},
+            "annotated": True,
+            "action": lambda: parse_file(path),
+        },
+        {
+            # The index is not checked in, so it is built from the annotated
+            # segments rather than by parsing the transcript again
+            "id": f"{hearing}:index",
+            "stage": "index",
+            "inputs": [f"{path}/hearing.json"],
+            "outputs": [f"{path}/hearing.ndjson", f"{path}/hearing.idx.npz"],
+            "params": {},
+            "action": lambda: index_tasks(path),
+        },
+        {
+            "id": f"{hearing}:template",
+            "stage": "template",
+            "inputs": [f"{path}/topics.txt"],
+            "outputs": [f"{path}/template.xml"],
+            "params": {},
+            "action": lambda: write_template(path),
+        },
+    ]
+
+    ground_truths = []
+    for export in annotator_files(path, "annotations_", ".json"):
+        n = os.path.basename(export)[len("annotations_"):-len(".json")]
+        ground_truths.append(f"{path}/ground_truth_{n}.csv")
+        stages.append({
+            "id": f"{hearing}:ground_truth_{n}",
+            "stage": "ground_truth",
+            "inputs": [export, f"{path}/topics.txt"],
+            "outputs": [ground_truths[-1]],
+            "params": {},
+            "action": lambda n=n: ground_truth_from_export(path, f"annotations_{n}.json", output=f"ground_truth_{n}"),
+        })
+
+    if len(ground_truths) >= 2:
+        stages.append({
+            "id": f"{hearing}:merge",
+            "stage": "merge",
+            "inputs": ground_truths,
+            "outputs": [f"{path}/ground_truth.csv"],
+            "params": {"policy": policy},
+            "edited": True,
+            "action": lambda: create_ground_truth(ground_truths, f"{path}/ground_truth.csv", policy),
+        })
+
+    for prompt in prompts:
+        # Each variant only depends on the components it contains, so editing
+        # e.g. prompts/examples.txt leaves the zero-shot variants alone
+        components = ["base", "output"] + SECTIONS[prompt]
+        stages.append({
+            "id": f"{hearing}:prompt/{prompt}",
+            "stage": "prompt",
+            "inputs": [f"{path}/hearing.txt", f"{path}/topics.txt", f"{path}/ground_truth.csv"]
+                      + [f"prompts/{c}.txt" for c in components],
+            "outputs": [f"{path}/prompts/{prompt}.txt"],
+            "params": {"layout": layout},
+            "action": lambda prompt=prompt: build_prompt(path, prompt, write=True, layout=layout),
+        })
+
+        for model in models:
+            cell = (hearing, model, prompt)
+            stages.append({
+                "id": f"{hearing}:call/{model}/{prompt}",
+                "stage": "call",
+                "inputs": [f"{path}/prompts/{prompt}.txt"],
+                "outputs": [run_grid.output_file(base_dir, *cell)],
+                "params": {"model": model},
+                "action": lambda cell=cell: call(base_dir, cell),
+            })
+
+    return stages
+
+
+def evaluate_stage(base_dir, hearings, jobs=1):
+    """
+    The corpus evaluation over every ground truth and model output that
+    evaluate_all_hearings.py reads.
+    """
+    inputs = [
+        f"{base_dir}/{hearing}/{name}"
+        for hearing in hearings
+        for name in ["ground_truth.csv"] + [f"output/{model}/{prompt_file}"
+                                            for model in evaluate_all_hearings.MODELS
+                                            for prompt_file in evaluate_all_hearings.PROMPT_FILES]
+    ]
+
+    return {
+        "id": "evaluate",
+        "stage": "evaluate",
+        "inputs": inputs,
+        "optional": inputs,
+        "outputs": [f"{base_dir}/overall_eval_results_topics.json"],
+        "params": {},
+        "action": lambda: evaluate_all_hearings.main(base_dir, jobs=jobs),
+    }
+
+
+def call(base_dir, cell, retries=5, backoff=2.0):
+    """
+    One run_grid cell on its own event loop (each runs in a pipeline thread).
+    """
+    failed = asyncio.run(run_grid.run_grid([cell], base_dir, concurrency=1, retries=retries, backoff=backoff))
+    if failed:
+        raise failed[0][1]
+
+
+def plan(base_dir="hearings", hearings=None, models=run_grid.MODELS, prompts=run_grid.PROMPTS, layout="classic",
+         policy="x", jobs=1):
+    if not hearings:
+        hearings = sorted(h for h in os.listdir(base_dir) if os.path.isfile(f"{base_dir}/{h}/hearing.txt"))
+
+    stages = [s for hearing in hearings for s in hearing_stages(base_dir, hearing, models, prompts, layout, policy)]
+    stages.append(evaluate_stage(base_dir, hearings, jobs))
+    return stages
+
+
+# ----------------------------------------------------------------------
+# Up-to-date checks
+
+def load_stamps(path=STAMPS):
+    """
+    The input hashes every stage last ran (or was adopted) with, as {id: stamp}.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_stamps(stamps, path=STAMPS):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+_hashes = {}
+
+
+def content_hash(path):
+    """
+    sha256 of a file, or None when it does not exist. Hashes are remembered
+    per size and modification time, so unchanged files are read only once.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (path, st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        with open(path, "rb") as f:
+            _hashes[key] = hashlib.sha256(f.read()).hexdigest()
+    return _hashes[key]
+
+
+def stamp_of(stage, written=False):
+    """
+    The hashes of the inputs and, when the stage has just written them, of
+    the outputs. Adopted outputs get no hashes: nothing is known about them.
+    """
+    return {
+        "inputs": {p: content_hash(p) for p in stage["inputs"]},
+        "params": stage["params"],
+        "outputs": {p: content_hash(p) for p in stage["outputs"]} if written else None,
+        "written": time.time() if written else None,
+    }
+
+
+def status(stage, stamps, force=False):
+    """
+    Why a stage has to run ("missing input", "no outputs", "changed", "forced",
+    "new", "edited") or None when it is up to date. Like make, but comparing
+    hashes of the inputs instead of modification times, so a stage whose
+    inputs were rewritten with the same content is not run again. "edited"
+    means that the inputs changed but the outputs were edited by hand since
+    the stage wrote them.
+    """
+    optional = set(stage.get("optional", ()))
+    if any(p not in optional and not os.path.isfile(p) for p in stage["inputs"]):
+        return "missing input"
+    if not all(os.path.isfile(p) for p in stage["outputs"]):
+        return "no outputs"
+    if force:
+        return "forced"
+    if stage["id"] not in stamps:
+        return "new"
+
+    stamp = stamps[stage["id"]]
+    current = stamp_of(stage)
+    if all(stamp.get(k) == current[k] for k in ("inputs", "params")):
+        return None
+    if stage.get("edited") and stamp.get("outputs") != stamp_of(stage, written=True)["outputs"]:
+        return "edited"
+    return "changed"
+
+
+# ----------------------------------------------------------------------
+# Runner
+
+def dependencies(stages):
+    """
+    {id: ids of the stages that produce its inputs}.
+    """
+    producers = {out: s["id"] for s in stages for out in s["outputs"]}
+    return {s["id"]: {producers[p] for p in s["inputs"] if p in producers} - {s["id"]} for s in stages}
+
+
+def run(stages, stamps, jobs=4, force=False, adopt=True, dry_run=False, skip=(), save=lambda stamps: None):
+    """
+    Run every stage that is not up to date once all the stages it depends
+    on are done, on `jobs` threads. Stages of different hearings (and the
+    calls of one hearing) run in parallel.
+
+    Stages that have never run but whose outputs already exist are adopted:
+    their current inputs are stamped and they are not run, so existing
+    outputs (model responses, adjudicated ground truths) are kept until one
+    of their inputs changes. Outputs older than an input the pipeline wrote
+    are stale and never adopted. Hand-edited outputs of "edited" stages and
+    the outputs of "annotated" stages are kept (with a warning) unless forced. Returns {id: "ran" | "up to date" |
+    "adopted" | "kept" | "skipped" | "blocked" | "failed"}.
+    """
+    deps = dependencies(stages)
+    by_id = {s["id"]: s for s in stages}
+    results = {}
+    lock = threading.Lock()
+
+    def say(message):
+        # print() writes the line and its end separately, which threads interleave
+        with lock:
+            print(message, flush=True)
+
+    def stale(stage, needs):
+        written = [stamps[d]["written"] for d in needs if (stamps.get(d) or {}).get("written")]
+        return bool(written) and max(written) > min(os.path.getmtime(p) for p in stage["outputs"])
+
+    def execute(stage, needs, upstream_ran=False):
+        reason = status(stage, stamps, force)
+
+        # In a dry run the inputs an upstream stage would rewrite are still
+        # the old ones, so assume they change
+        if dry_run and upstream_ran and reason in (None, "new"):
+            reason = "upstream"
+
+        if stage["stage"] in skip:
+            return "skipped"
+        if reason is None:
+            return "up to date"
+        if reason == "missing input":
+            say(f"⏭ {stage['id']}: missing input")
+            return "blocked"
+        if reason == "new" and adopt and not stale(stage, needs):
+            with lock:
+                stamps[stage["id"]] = stamp_of(stage)
+            return "adopted"
+        if stage.get("annotated") and reason in ("new", "changed"):
+            say(f"⚠ {stage['id']}: inputs changed, but annotations refer to {', '.join(stage['outputs'])}; "
+                f"keeping it (use --force to rebuild)")
+            return "kept"
+        if reason == "edited":
+            say(f"⚠ {stage['id']}: inputs changed, but {', '.join(stage['outputs'])} was edited by hand; "
+                  f"keeping it (use --force to rebuild)")
+            return "kept"
+
+        say(f"→ {stage['id']} ({reason})")
+        if dry_run:
+            return "ran"
+
+        start = time.perf_counter()
+        stage["action"]()
+
+        with lock:
+            stamps[stage["id"]] = stamp_of(stage, written=True)
+            save(stamps)
+        say(f"✓ {stage['id']} ({time.perf_counter() - start:.1f} s)")
+        return "ran"
+
+    pending = dict(deps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for sid, needs in list(pending.items()):
+                if needs - results.keys():
+                    continue
+                del pending[sid]
+
+                if any(results[d] in ("blocked", "failed") for d in needs):
+                    say(f"⏭ {sid}: an upstream stage did not finish")
+                    results[sid] = "blocked"
+                else:
+                    upstream_ran = any(results[d] == "ran" for d in needs)
+                    running[pool.submit(execute, by_id[sid], needs, upstream_ran)] = sid
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages with circular inputs: {', '.join(sorted(pending))}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                sid = running.pop(future)
+                try:
+                    results[sid] = future.result()
+                except Exception as e:
+                    say(f"⨉ {sid} failed: {e}")
+                    results[sid] = "failed"
+
+    save(stamps)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Rebuild every stage of the corpus whose inputs changed")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all with a hearing.txt)")
+    parser.add_argument('-d', '--base-dir', default="hearings")
+    parser.add_argument('-m', '--models', nargs='+', default=run_grid.MODELS)
+    parser.add_argument('-p', '--prompts', nargs='+', default=run_grid.PROMPTS, choices=run_grid.PROMPTS)
+    parser.add_argument('-l', '--layout', default="classic", choices=LAYOUTS)
+    parser.add_argument('--policy', default="x", choices=POLICIES, help="How merge resolves disagreements")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="Stages run at the same time")
+    parser.add_argument('-s', '--skip', nargs='+', default=[], choices=STAGES, help="Stages not to run, e.g. call")
+    parser.add_argument('-f', '--force', action='store_true', help="Run every stage, even if it is up to date")
+    parser.add_argument('--no-adopt', action='store_true', help="Also run stages that were never run before")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="Only print the stages that would run")
+
+    args = parser.parse_args()
+
+    stages = plan(args.base_dir, args.hearings, args.models, args.prompts, args.layout, args.policy)
+    stamps = load_stamps()
+
+    results = run(stages, stamps, args.jobs, args.force, not args.no_adopt, args.dry_run, args.skip,
+                  save=save_stamps if not args.dry_run else lambda stamps: None)
+
+    counts = {}
+    for result in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    print("✓ " + ", ".join(f"{n} {result}" for result, n in sorted(counts.items())))
+
+    if counts.get("failed"):
+        sys.exit(1)
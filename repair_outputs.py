@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import csv
+import difflib
+import os
+import shutil
+import sys
+
+from call_chatgpt import strip_backticks
+from create_ground_truth import segment_speaker
+from create_prompt import estimate_tokens, iter_sections, load_components, load_hearing
+from label_store import CODES
+from output_format import OutputFormatError, validate_output
+from parse_hearing import dedent_file, iter_segments, open_segments, speaker_segments
+from run_grid import MODELS, PROMPTS, cached_response, load_prompt, output_file
+
+
+def read_output(path):
+    """
+    The header and rows of a model output CSV, without code fences.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        rows = [row for row in csv.reader(strip_backticks(f.read()).splitlines()) if row]
+
+    return (rows[0], rows[1:]) if rows else ([], [])
+
+
+def match_topic(name, topics, taken):
+    # A misspelled header ("Tariffs" for "Tarrifs") is the closest free topic
+    if name in topics:
+        return name
+    close = difflib.get_close_matches(name, [t for t in topics if t not in taken], n=1, cutoff=0.85)
+    return close[0] if close else None
+
+
+def match_speaker(name, speakers, taken):
+    # Names are only completed, never guessed: "Dr. Turner Lee" is "Dr. Turner",
+    # but "Mr. Lee" is not "Ms. Lee"
+    if name in speakers:
+        return name if name not in taken else None
+    candidates = [s for s in speakers if s not in taken and (name.startswith(s + " ") or s.startswith(name + " "))]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def diagnose(path, speakers, topics):
+    """
+    Map a model output onto the expected speaker × topic grid. Returns
+    (grid, renamed, dropped): grid is {speaker: {topic: label}} with the
+    valid cells only, renamed lists the (header or speaker, expected name)
+    pairs that were matched by spelling rather than exactly, and dropped the
+    rows of unknown or repeated speakers.
+    """
+    header, rows = read_output(path)
+    columns, renamed = {}, []
+
+    for j, name in enumerate(header[1:], start=1):
+        topic = match_topic(name.strip(), topics, columns.values())
+        if topic is not None:
+            columns[j] = topic
+            if topic != name.strip():
+                renamed.append((name.strip(), topic))
+
+    grid, dropped = {}, []
+    for row in rows:
+        speaker = match_speaker(row[0].strip(), speakers, grid)
+        if speaker is None:
+            dropped.append(row[0].strip())
+            continue
+        if speaker != row[0].strip():
+            renamed.append((row[0].strip(), speaker))
+
+        grid[speaker] = {topic: row[j].strip() for j, topic in columns.items()
+                         if j < len(row) and row[j].strip() in CODES}
+
+    return grid, renamed, dropped
+
+
+def missing_cells(grid, speakers, topics):
+    """
+    {speaker: [topics]} of every cell of the expected grid without a valid label.
+    """
+    missing = {}
+    for speaker in speakers:
+        topics_left = [t for t in topics if t not in grid.get(speaker, {})]
+        if topics_left:
+            missing[speaker] = topics_left
+    return missing
+
+
+def speaker_turns(path, speaker):
+    """
+    The turns of one speaker, from the segment index when parse_hearing.py
+    wrote one, else from the transcript.
+    """
+    if os.path.isfile(f"{path}/hearing.idx.npz"):
+        return [segment["text"] for segment in speaker_segments(open_segments(path), speaker)]
+
+    with open(f"{path}/hearing.txt", "r", encoding="utf-8") as f:
+        return [segment for segment in iter_segments(dedent_file(f)) if segment_speaker(segment) == speaker]
+
+
+def build_repair_prompt(prompt, components, speaker, topics, turns):
+    """
+    A follow-up prompt for the missing topics of one speaker, with the same
+    instructions as the prompt variant but only that speaker's turns.
+    """
+    parts = [components["task"] + "\n\n"]
+    parts.extend(iter_sections(prompt, components))
+
+    parts.append("OUTPUT FORMAT\n")
+    parts.append(components["repair"] + "\n\n")
+
+    parts.append("LIST OF SPEAKERS\n")
+    parts.append(speaker + "\n\n\n")
+
+    parts.append("LIST OF TOPICS\n")
+    parts.append(", ".join(topics) + "\n\n\n")
+
+    parts.append(f"TURNS OF {speaker.upper()}\n")
+    parts.append("\n\n".join(turns))
+
+    return "".join(parts)
+
+
+def write_grid(path, grid, speakers, topics):
+    """
+    Write the grid in the order of the ground truth; cells that are still
+    missing are left empty.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["Speaker"] + topics)
+        writer.writerows([speaker] + [grid.get(speaker, {}).get(t, "") for t in topics] for speaker in speakers)
+
+
+def plan_repairs(base_dir="hearings", hearings=None, models=MODELS, prompts=PROMPTS):
+    """
+    Every existing output that differs from the expected grid (missing or
+    invalid cells, misspelled names, unknown speakers or rows out of order),
+    as dicts with the cell, its grid, the renamed and dropped names and the
+    missing cells.
+    """
+    if not hearings:
+        hearings = sorted(h for h in os.listdir(base_dir) if os.path.isfile(f"{base_dir}/{h}/ground_truth.csv"))
+
+    repairs = []
+
+    for hearing in hearings:
+        expected = load_hearing(f"{base_dir}/{hearing}")
+
+        for model in models:
+            for prompt in prompts:
+                path = output_file(base_dir, hearing, model, prompt)
+                if not os.path.isfile(path):
+                    continue
+
+                grid, renamed, dropped = diagnose(path, expected["speakers"], expected["topics"])
+                missing = missing_cells(grid, expected["speakers"], expected["topics"])
+
+                if missing or renamed or dropped or list(grid) != expected["speakers"]:
+                    repairs.append({"cell": (hearing, model, prompt), "grid": grid, "renamed": renamed,
+                                    "dropped": dropped, "missing": missing})
+
+    return repairs
+
+
+async def repair(client, semaphore, job, base_dir="hearings", retries=5, backoff=2.0, no_cache=False):
+    """
+    Ask for the missing cells of one output, one small request per speaker,
+    and write the merged grid back. The original output is kept next to it
+    as <prompt>.csv.orig. Returns the (speaker, topic) cells still missing.
+    """
+    hearing, model, prompt_name = job["cell"]
+    path = f"{base_dir}/{hearing}"
+    expected = load_hearing(path)
+    components = load_components()
+    grid = {speaker: dict(cells) for speaker, cells in job["grid"].items()}
+
+    async def ask(speaker, topics):
+        turns = speaker_turns(path, speaker)
+        if not turns:
+            return
+
+        prompt = build_repair_prompt(prompt_name, components, speaker, topics, turns)
+        record = await cached_response(client, semaphore, model, prompt, retries, backoff, no_cache,
+                                       tags={"hearing": hearing, "prompt": prompt_name, "repair": speaker})
+
+        try:
+            rows, _ = validate_output(record["output_text"], [speaker], topics)
+        except OutputFormatError as e:
+            print(f"⚠ {hearing} / {model} / {prompt_name}: unusable answer for {speaker} ({e})")
+            return
+
+        # The answer may list the topics in another order than asked
+        header = [cell.strip() for cell in next(csv.reader([rows[0]]))]
+        for row in rows[1:]:
+            grid.setdefault(speaker, {}).update(zip(header[1:], (cell.strip() for cell in next(csv.reader([row]))[1:])))
+
+    await asyncio.gather(*(ask(speaker, topics) for speaker, topics in job["missing"].items()))
+
+    out_file = output_file(base_dir, hearing, model, prompt_name)
+    if not os.path.isfile(f"{out_file}.orig"):
+        shutil.copyfile(out_file, f"{out_file}.orig")
+    write_grid(out_file, grid, expected["speakers"], expected["topics"])
+
+    left = missing_cells(grid, expected["speakers"], expected["topics"])
+    return [(speaker, topic) for speaker, topics in left.items() for topic in topics]
+
+
+async def run(repairs, base_dir="hearings", concurrency=8, retries=5, backoff=2.0, no_cache=False):
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncOpenAI(max_retries=0) as client:
+        results = await asyncio.gather(
+            *(repair(client, semaphore, job, base_dir, retries, backoff, no_cache) for job in repairs),
+            return_exceptions=True,
+        )
+
+    return list(zip(repairs, results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Re-ask only the missing or invalid cells of model outputs")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    parser.add_argument('-m', '--models', nargs='+', default=MODELS)
+    parser.add_argument('-p', '--prompts', nargs='+', default=PROMPTS, choices=PROMPTS)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-r', '--retries', type=int, default=5)
+    parser.add_argument('-b', '--backoff', type=float, default=2.0, help="Initial backoff in seconds")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, then refresh the cache")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="Only print what would be repaired")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+    repairs = plan_repairs(base_dir, args.hearings, args.models, args.prompts)
+    components = load_components()
+
+    for job in repairs:
+        hearing, model, prompt = job["cell"]
+        path = f"{base_dir}/{hearing}"
+        cells = sum(len(topics) for topics in job["missing"].values())
+
+        # What the follow-up requests cost compared to running the whole prompt again
+        repair_tokens = sum(estimate_tokens(build_repair_prompt(prompt, components, speaker, topics,
+                                                                speaker_turns(path, speaker)))
+                            for speaker, topics in job["missing"].items())
+        full_tokens = estimate_tokens(load_prompt(base_dir, hearing, prompt, build=True))
+
+        print(f"→ {hearing} / {model} / {prompt}: {cells} missing cells of {len(job['missing'])} speakers, "
+              f"{len(job['renamed'])} names matched by spelling, {len(job['dropped'])} rows dropped, "
+              f"~{repair_tokens} prompt tokens ({repair_tokens / full_tokens:.0%} of a full call)")
+        for name, expected in job["renamed"]:
+            print(f"    {name!r} → {expected!r}")
+        for name in job["dropped"]:
+            print(f"    {name!r} dropped")
+
+    print(f"✓ {len(repairs)} outputs to repair")
+
+    if args.dry_run or not repairs:
+        sys.exit(0)
+
+    failed = 0
+    for job, result in asyncio.run(run(repairs, base_dir, args.concurrency, args.retries, args.backoff,
+                                       args.no_cache)):
+        hearing, model, prompt = job["cell"]
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"⨉ {hearing} / {model} / {prompt} failed: {result}")
+        elif result:
+            print(f"⚠ {hearing} / {model} / {prompt}: {len(result)} cells are still missing")
+        else:
+            print(f"✓ Repaired {output_file(base_dir, hearing, model, prompt)}")
+
+    if failed:
+        sys.exit(1)
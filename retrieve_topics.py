@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+
+from call_chatgpt import strip_backticks
+from create_ground_truth import segment_speaker, write_ground_truth
+from create_prompt import LAYOUTS, estimate_tokens, iter_prompt, load_components, load_hearing
+from run_grid import MODELS, PROMPTS, cached_response
+from segment_inference import load_segments
+
+
+def relevance_scores(path, segments, topics, cache_file="relevance.json"):
+    """
+    TF-IDF cosine similarity of every segment (rows) to every topic (columns).
+    Scores are cached in the hearing folder and recomputed when the segments
+    or topics change.
+    """
+    key = hashlib.sha256(json.dumps([segments, topics]).encode("utf-8")).hexdigest()
+    cache_path = f"{path}/{cache_file}"
+
+    if os.path.isfile(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["scores"]
+
+    # scikit-learn is slow to import and only needed when the cache is stale
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True)
+    matrix = vectorizer.fit_transform([s["text"] for s in segments] + topics)
+
+    # Rows are L2-normalised, so the dot product is the cosine similarity
+    scores = (matrix[:len(segments)] @ matrix[len(segments):].T).toarray()
+    scores = [[round(float(v), 6) for v in row] for row in scores]
+
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "topics": topics, "scores": scores}, f)
+
+    return scores
+
+
+def group_topics(topics, group_size=1):
+    return [list(range(i, min(i + group_size, len(topics)))) for i in range(0, len(topics), group_size)]
+
+
+def select_segments(segments, scores, topic_ids, speakers, top_k=5, min_score=0.0):
+    """
+    Pick the top_k segments of every speaker for a group of topics, ranked by
+    their best score within the group. Returns them in transcript order.
+    """
+    by_speaker = {}
+
+    for i, segment in enumerate(segments):
+        speaker = segment_speaker(segment["text"])
+        score = max(scores[i][t] for t in topic_ids)
+
+        if speaker in speakers and score > min_score:
+            by_speaker.setdefault(speaker, []).append((score, i))
+
+    selected = []
+    for ranked in by_speaker.values():
+        ranked.sort(reverse=True)
+        selected.extend(i for _, i in ranked[:top_k])
+
+    return [segments[i] for i in sorted(selected)]
+
+
+def parse_output_table(output, topics):
+    """
+    Read a speaker × topic CSV answer into {speaker: labels}, with the labels
+    in the order of `topics`. Unknown columns are ignored and anything that is
+    not -1, 0 or 1 counts as 0.
+    """
+    rows = list(csv.reader(io.StringIO(strip_backticks(output))))
+    if not rows:
+        return {}
+
+    header = [h.strip() for h in rows[0][1:]]
+    columns = []
+    for i, topic in enumerate(topics):
+        if topic in header:
+            columns.append(header.index(topic))
+        elif len(header) == len(topics):
+            # The model rewrote the topic name; trust the column position
+            columns.append(i)
+        else:
+            columns.append(None)
+
+    table = {}
+    for row in rows[1:]:
+        if not row:
+            continue
+
+        labels = []
+        for col in columns:
+            value = row[col + 1].strip() if col is not None and col + 1 < len(row) else "0"
+            labels.append(int(value) if value in ("-1", "0", "1") else 0)
+
+        table[row[0].strip()] = labels
+
+    return table
+
+
+async def infer_cell(client, semaphore, cell, base_dir="hearings", group_size=1, top_k=5, layout="classic",
+                     retries=5, backoff=2.0, no_cache=False):
+    hearing, model, prompt = cell
+    path = f"{base_dir}/{hearing}"
+
+    components = load_components()
+    info = load_hearing(path)
+    topics, speakers = info["topics"], info["speakers"]
+
+    segments = load_segments(path)
+    scores = relevance_scores(path, segments, topics)
+    groups = group_topics(topics, group_size)
+
+    prompts = []
+    for topic_ids in groups:
+        excerpts = select_segments(segments, scores, topic_ids, set(speakers), top_k)
+        group_info = {
+            "speakers": speakers,
+            "topics": [topics[t] for t in topic_ids],
+            "transcript": "\n\n".join(s["text"] for s in excerpts),
+        }
+        prompts.append("".join(iter_prompt(prompt, components, group_info, layout)))
+
+    print(f"✓ {hearing} / {model} / {prompt}: {len(groups)} topic groups, "
+          f"~{sum(map(estimate_tokens, prompts))} prompt tokens in total")
+
+    records = await asyncio.gather(*(
+        cached_response(client, semaphore, model, p, retries, backoff, no_cache,
+                        tags={"hearing": hearing, "prompt": f"{prompt}_retrieval", "group": i})
+        for i, p in enumerate(prompts)
+    ))
+
+    labels = {sp: [0] * len(topics) for sp in speakers}
+
+    for topic_ids, record in zip(groups, records):
+        table = parse_output_table(record["output_text"], [topics[t] for t in topic_ids])
+        for sp in speakers:
+            for t, label in zip(topic_ids, table.get(sp, [])):
+                labels[sp][t] = label
+
+    output_path = f"{path}/output/{model}"
+    os.makedirs(output_path, exist_ok=True)
+    write_ground_truth(["Speaker"] + topics, [[sp] + labels[sp] for sp in speakers],
+                       folder=output_path, filename=f"{prompt}_retrieval")
+
+    print(f"✓ Wrote response to {output_path}/{prompt}_retrieval.csv")
+
+
+async def run(cells, base_dir="hearings", group_size=1, top_k=5, layout="classic", concurrency=8, retries=5,
+              backoff=2.0, no_cache=False):
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncOpenAI(max_retries=0) as client:
+        results = await asyncio.gather(
+            *(infer_cell(client, semaphore, cell, base_dir, group_size, top_k, layout, retries, backoff, no_cache)
+              for cell in cells),
+            return_exceptions=True,
+        )
+
+    return [(cell, r) for cell, r in zip(cells, results) if isinstance(r, BaseException)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Topic-relevance retrieval inference")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    parser.add_argument('-m', '--models', nargs='+', default=MODELS)
+    parser.add_argument('-p', '--prompts', nargs='+', default=PROMPTS, choices=PROMPTS)
+    parser.add_argument('-g', '--group-size', type=int, default=1, help="Topics per request")
+    parser.add_argument('-k', '--top-k', type=int, default=5, help="Turns per speaker and topic group")
+    parser.add_argument('-l', '--layout', default="classic", choices=LAYOUTS)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-r', '--retries', type=int, default=5)
+    parser.add_argument('-b', '--backoff', type=float, default=2.0, help="Initial backoff in seconds")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, then refresh the cache")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+    hearings = args.hearings or sorted(h for h in os.listdir(base_dir) if os.path.isdir(f"{base_dir}/{h}"))
+
+    cells = [
+        (hearing, model, prompt)
+        for hearing in hearings
+        if os.path.isfile(f"{base_dir}/{hearing}/hearing.json") and os.path.isfile(f"{base_dir}/{hearing}/ground_truth.csv")
+        for model in args.models
+        for prompt in args.prompts
+    ]
+
+    failed = asyncio.run(run(cells, base_dir, args.group_size, args.top_k, args.layout, args.concurrency,
+                             args.retries, args.backoff, args.no_cache))
+
+    for (hearing, model, prompt), error in failed:
+        print(f"⨉ {hearing} / {model} / {prompt} failed: {error}")
+
+    if failed:
+        sys.exit(1)
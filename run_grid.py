@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import llm_cache
+import telemetry
+from call_chatgpt import write_output
+from create_prompt import LAYOUTS, build_prompt, load_hearing, shared_prefix_length
+from output_format import (OutputFormatError, check_record, feed_validator, finish_validator, new_validator,
+                           validate_output)
+from structured_output import schema_of, structured_table, text_format
+
+MODELS = ["chatgpt-4o-latest", "o3"]
+PROMPTS = ["zero_shot", "few_shot", "zero_shot_cot", "few_shot_cot"]
+
+
+def output_file(base_dir, hearing, model, prompt):
+    return f"{base_dir}/{hearing}/output/{model}/{prompt}.csv"
+
+
+def load_prompt(base_dir, hearing, prompt, build=False, layout="classic"):
+    """
+    Read a prompt from the hearing's prompts folder, or compile it in memory.
+    """
+    if build:
+        return build_prompt(f"{base_dir}/{hearing}", prompt, layout=layout)
+    return Path(f"{base_dir}/{hearing}/prompts/{prompt}.txt").read_text(encoding="utf-8")
+
+
+def plan_grid(base_dir="hearings", hearings=None, models=MODELS, prompts=PROMPTS, skip_existing=False, build=False):
+    """
+    List every (hearing, model, prompt) cell that has a prompt file on disk, or
+    a ground truth to build the prompt from. With skip_existing, cells that
+    already have an output CSV are left out.
+    """
+    if not hearings:
+        hearings = [h for h in os.listdir(base_dir) if os.path.isdir(f"{base_dir}/{h}")]
+
+    cells = []
+
+    for hearing in sorted(hearings):
+        for prompt in prompts:
+            source = "ground_truth.csv" if build else f"prompts/{prompt}.txt"
+            if not os.path.isfile(f"{base_dir}/{hearing}/{source}"):
+                continue
+
+            for model in models:
+                if skip_existing and os.path.isfile(output_file(base_dir, hearing, model, prompt)):
+                    continue
+                cells.append((hearing, model, prompt))
+
+    return cells
+
+
+def report_shared_prefixes(cells, base_dir="hearings", build=False, layout="classic"):
+    """
+    Print how much of the prompts of each hearing is a common prefix, i.e. how
+    much provider-side prompt caching can reuse between its calls.
+    """
+    prompts_by_hearing = {}
+    for hearing, _, prompt in cells:
+        prompts_by_hearing.setdefault(hearing, set()).add(prompt)
+
+    for hearing, prompts in sorted(prompts_by_hearing.items()):
+        texts = [load_prompt(base_dir, hearing, p, build, layout) for p in sorted(prompts)]
+        shared = shared_prefix_length(texts)
+        longest = max(map(len, texts))
+        print(f"  {hearing}: {len(texts)} prompts share a prefix of {shared}/{longest} characters ({shared / longest:.0%})")
+
+
+def is_retryable(error):
+    from openai import APIConnectionError, APIStatusError
+
+    # Connection errors and timeouts, rate limits and server-side failures
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+async def stream_once(client, model, prompt, validator, part, **params):
+    """
+    Stream one response. The output text goes through the validator (if any)
+    and the rows it accepts are appended to `part` as they arrive. Returns
+    (response, ttfb, ttft, missing speakers). An OutputFormatError is raised
+    as soon as the output goes off-format; leaving the stream closes the
+    connection, which stops the generation.
+    """
+    ttfb = ttft = None
+    missing = []
+    sent = time.perf_counter()
+
+    async with client.responses.stream(model=model, input=prompt, **params) as stream:
+        async for event in stream:
+            if ttfb is None:
+                ttfb = time.perf_counter() - sent
+            if event.type != "response.output_text.delta":
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - sent
+
+            if validator is None:
+                part.write(event.delta)
+            else:
+                part.writelines(row + "\n" for row in feed_validator(validator, event.delta))
+            part.flush()
+
+        response = await stream.get_final_response()
+
+    if validator is not None:
+        rows, missing = finish_validator(validator)
+        part.writelines(row + "\n" for row in rows)
+
+    return response, ttfb, ttft, missing
+
+
+async def request_response(client, semaphore, model, prompt, retries=5, backoff=2.0, tags=None, expected=None,
+                           part_path=None, format_retries=2, **params):
+    """
+    Send one prompt and return the response. Retryable errors are retried
+    with exponential backoff (and jitter); the semaphore is released while waiting.
+    Every call is recorded as a telemetry event, tagged with tags.
+
+    With expected=(speakers, topics), the response is streamed and validated
+    row by row (see output_format.py), and the valid rows are written to
+    part_path as they arrive. An off-format output is aborted right away and
+    asked again, up to format_retries times; the last attempt is not
+    validated, so the call still ends with an output.
+
+    With a structured-output format in params, a response that was cut off,
+    refused or does not match the schema is asked again up to format_retries
+    times, after which OutputFormatError is raised.
+    """
+    attempt = format_attempt = 0
+    start = time.perf_counter()
+    structured = schema_of(params) is not None
+
+    while True:
+        sent = time.perf_counter()
+        response = None
+        try:
+            async with semaphore:
+                sent = time.perf_counter()
+
+                if expected is None:
+                    # The streaming wrapper hands over the response as soon as the headers arrive
+                    async with client.responses.with_streaming_response.create(model=model, input=prompt, **params) as raw:
+                        ttfb = time.perf_counter() - sent
+                        response = await raw.parse()
+                    timings = {"ttfb": ttfb}
+                    if structured:
+                        structured_table(llm_cache.make_record(model, params, response))
+                else:
+                    validator = new_validator(*expected) if format_attempt < format_retries else None
+                    with open(part_path, "w", encoding="utf-8") as part:
+                        response, ttfb, ttft, missing = await stream_once(client, model, prompt, validator, part,
+                                                                          **params)
+                    timings = {"ttfb": ttfb, "ttft": ttft, "format_retries": format_attempt, "missing": len(missing)}
+                    if missing:
+                        print(f"⚠ {model}: no row for {', '.join(missing)}")
+
+                latency = time.perf_counter() - sent
+
+            telemetry.record(telemetry.make_event(
+                model, prompt, response, tags, **timings, latency=latency, total=time.perf_counter() - start,
+                retries=attempt,
+            ))
+            return response
+
+        except OutputFormatError as e:
+            # A streamed output is aborted, a structured one was paid for in full
+            failed_after = time.perf_counter() - sent
+            telemetry.record(telemetry.make_event(
+                model, prompt, response, tags, latency=failed_after, total=time.perf_counter() - start,
+                retries=attempt, format_retries=format_attempt, aborted=expected is not None,
+                error=f"OutputFormatError: {e}",
+            ))
+
+            if format_attempt >= format_retries:
+                raise
+            format_attempt += 1
+            print(f"⚠ {model}: off-format output after {failed_after:.1f}s ({e}), "
+                  f"asking again {format_attempt}/{format_retries}")
+
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                telemetry.record(telemetry.make_event(
+                    model, prompt, None, tags, total=time.perf_counter() - start, retries=attempt,
+                    error=f"{e.__class__.__name__}: {e}",
+                ))
+                raise
+
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            attempt += 1
+            print(f"⚠ {model}: {e.__class__.__name__}, retry {attempt}/{retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def cached_response(client, semaphore, model, prompt, retries=5, backoff=2.0, no_cache=False, tags=None,
+                          params=None, **stream):
+    """
+    Return the cache record for a prompt, calling the API only on a miss.
+    Request params (e.g. a structured-output format) are part of the cache
+    key. Streaming options (expected, part_path, format_retries) are passed
+    on to request_response; with expected, a cached output that is not a
+    valid table counts as a miss, and an off-format answer is stored with
+    the reason as "invalid". Structured outputs are only stored once they
+    match their schema, and cached ones that do not count as a miss.
+    """
+    key = llm_cache.cache_key(model, prompt, params)
+    record = None if no_cache else llm_cache.load(key)
+    expected = stream.get("expected")
+
+    if record is not None and (expected is not None or schema_of(params) is not None):
+        try:
+            if expected is not None:
+                check_record(record, *expected)
+            else:
+                structured_table(record)
+        except OutputFormatError as e:
+            print(f"⚠ {model}: cached output is off-format ({e}), asking again")
+            record = None
+
+    if record is None:
+        response = await request_response(client, semaphore, model, prompt, retries=retries, backoff=backoff,
+                                          tags=tags, **stream, **(params or {}))
+        record = llm_cache.make_record(model, params, response)
+        if expected is not None:
+            try:
+                validate_output(record["output_text"], *expected)
+            except OutputFormatError as e:
+                record["invalid"] = str(e)
+        llm_cache.store(key, record)
+    else:
+        telemetry.record(telemetry.make_event(model, prompt, None, tags, cached=True))
+
+    return record
+
+
+async def run_cell(client, semaphore, cell, base_dir="hearings", retries=5, backoff=2.0, no_cache=False,
+                   build=False, layout="classic", stream=False, format_retries=2, structured=False):
+    hearing, model, prompt_name = cell
+    prompt = load_prompt(base_dir, hearing, prompt_name, build, layout)
+
+    out_file = output_file(base_dir, hearing, model, prompt_name)
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+
+    options = {}
+    if structured:
+        # The output is constrained to a table of exactly these speakers and topics
+        hearing_files = load_hearing(f"{base_dir}/{hearing}")
+        options = {"params": {"text": text_format(hearing_files["speakers"], hearing_files["topics"])},
+                   "format_retries": format_retries}
+    elif stream:
+        # Rows are checked against the speakers and topics the prompt lists
+        hearing_files = load_hearing(f"{base_dir}/{hearing}")
+        options = {"expected": (hearing_files["speakers"], hearing_files["topics"]),
+                   "part_path": f"{out_file}.part", "format_retries": format_retries}
+
+    record = await cached_response(client, semaphore, model, prompt, retries, backoff, no_cache,
+                                   tags={"hearing": hearing, "prompt": prompt_name}, **options)
+
+    write_output(os.path.dirname(out_file), prompt_name, record)
+    if stream and os.path.isfile(f"{out_file}.part"):
+        os.remove(f"{out_file}.part")
+
+    print(f"✓ Wrote response to {out_file}")
+
+
+async def run_grid(cells, base_dir="hearings", concurrency=8, retries=5, backoff=2.0, no_cache=False,
+                   build=False, layout="classic", stream=False, format_retries=2, structured=False):
+    """
+    Run all cells concurrently over one client. Returns the cells that failed,
+    paired with their exception; a failed cell never cancels the others.
+    """
+    # Imported only when calls are made: planning and --dry-run stay fast
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # Retries are handled by request_response so that the backoff is ours to tune
+    async with AsyncOpenAI(max_retries=0) as client:
+        results = await asyncio.gather(
+            *(run_cell(client, semaphore, cell, base_dir, retries, backoff, no_cache, build, layout, stream,
+                       format_retries, structured) for cell in cells),
+            return_exceptions=True,
+        )
+
+    return [(cell, r) for cell, r in zip(cells, results) if isinstance(r, BaseException)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Call LLMs on every hearing, model and prompt")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    parser.add_argument('-m', '--models', nargs='+', default=MODELS)
+    parser.add_argument('-p', '--prompts', nargs='+', default=PROMPTS, choices=PROMPTS)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-r', '--retries', type=int, default=5)
+    parser.add_argument('-b', '--backoff', type=float, default=2.0, help="Initial backoff in seconds")
+    parser.add_argument('-s', '--skip-existing', action='store_true', help="Skip cells that already have an output")
+    parser.add_argument('--build', action='store_true', help="Compile prompts in memory instead of reading prompts/")
+    parser.add_argument('-l', '--layout', default="classic", choices=LAYOUTS, help="Prompt layout used with --build")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, then refresh the cache")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--stream', action='store_true',
+                      help="Stream responses, check every row and ask again as soon as the output is off-format")
+    mode.add_argument('--structured', action='store_true',
+                      help="Constrain outputs to a JSON schema of each hearing's speakers and topics")
+    parser.add_argument('--format-retries', type=int, default=2,
+                        help="Off-format outputs asked again with --stream or --structured")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="Only print the planned cells")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+    cells = plan_grid(base_dir, args.hearings, args.models, args.prompts, args.skip_existing, args.build)
+
+    print(f"✓ Planned {len(cells)} calls")
+    report_shared_prefixes(cells, base_dir, args.build, args.layout)
+
+    if args.dry_run:
+        for hearing, model, prompt in cells:
+            print(f"  {hearing} / {model} / {prompt}")
+        sys.exit(0)
+
+    failed = asyncio.run(run_grid(cells, base_dir, args.concurrency, args.retries, args.backoff, args.no_cache,
+                                  args.build, args.layout, args.stream, args.format_retries, args.structured))
+
+    for (hearing, model, prompt), error in failed:
+        print(f"⨉ {hearing} / {model} / {prompt} failed: {error}")
+
+    print(f"✓ Finished {len(cells) - len(failed)}/{len(cells)} calls")
+
+    if failed:
+        sys.exit(1)
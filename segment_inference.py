@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+
+from create_ground_truth import create_ground_truth_table, segment_speaker, write_ground_truth
+from create_prompt import estimate_tokens, iter_sections, load_components, load_hearing
+from run_grid import MODELS, PROMPTS, cached_response
+
+
+def load_segments(path, filename="hearing.json"):
+    # parse_hearing.py writes the same segments as NDJSON, which is quicker to read
+    if filename == "hearing.json" and os.path.isfile(f"{path}/hearing.ndjson"):
+        with open(f"{path}/hearing.ndjson", "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    with open(f"{path}/{filename}", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def group_segments(segments, max_tokens=6000):
+    """
+    Split segments into consecutive groups of at most max_tokens (estimated).
+    A segment that is longer than the budget on its own forms its own group.
+    """
+    groups = []
+    current, current_tokens = [], 0
+
+    for segment in segments:
+        tokens = estimate_tokens(segment["text"])
+
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+
+        current.append(segment)
+        current_tokens += tokens
+
+    if current:
+        groups.append(current)
+
+    return groups
+
+
+def build_segment_prompt(prompt, components, topics, group):
+    parts = [components["task"] + "\n\n"]
+    parts.extend(iter_sections(prompt, components))
+
+    parts.append("OUTPUT FORMAT\n")
+    parts.append(components["segments"] + "\n\n")
+
+    parts.append("LIST OF TOPICS\n")
+    parts.append(", ".join(topics) + "\n\n\n")
+
+    parts.append("HEARING SEGMENTS\n")
+    for segment in group:
+        parts.append(f"[{segment['id']}] {segment['text']}\n\n")
+
+    return "".join(parts)
+
+
+def parse_segment_labels(output, n_topics):
+    """
+    Read the per-segment CSV of one group into {segment id: stances}. Rows
+    that are not a segment id followed by n_topics labels are skipped.
+    """
+    labels = {}
+    lines = [ln for ln in output.strip().splitlines() if not ln.strip().startswith("```")]
+
+    for row in csv.reader(io.StringIO("\n".join(lines))):
+        try:
+            seg_id = int(row[0].strip().strip("[]"))
+            stances = [int(v) for v in row[1:]]
+        except (ValueError, IndexError):
+            continue    # header or malformed row
+
+        if len(stances) == n_topics and all(s in (-1, 0, 1) for s in stances):
+            labels[seg_id] = stances
+
+    return labels
+
+
+def reduce_labels(segments, labels, topics, speakers):
+    """
+    Aggregate segment labels per speaker with the same clamped sum as the
+    ground truth. Rows follow the order of `speakers`; speakers without
+    segments get all zeros.
+    """
+    annotations = [
+        {
+            "id": segment["id"],
+            "speaker": segment_speaker(segment["text"]),
+            "stances": labels.get(segment["id"], [0] * len(topics)),
+        }
+        for segment in segments
+    ]
+
+    header, rows = create_ground_truth_table(topics, annotations)
+    rows_by_speaker = {row[0]: row for row in rows}
+
+    return header, [rows_by_speaker.get(sp, [sp] + [0] * len(topics)) for sp in speakers]
+
+
+async def infer_cell(client, semaphore, cell, base_dir="hearings", max_tokens=6000, retries=5, backoff=2.0,
+                     no_cache=False):
+    hearing, model, prompt = cell
+    path = f"{base_dir}/{hearing}"
+
+    components = load_components()
+    info = load_hearing(path)
+    segments = load_segments(path)
+    groups = group_segments(segments, max_tokens)
+
+    records = await asyncio.gather(*(
+        cached_response(client, semaphore, model, build_segment_prompt(prompt, components, info["topics"], group),
+                        retries, backoff, no_cache, tags={"hearing": hearing, "prompt": f"{prompt}_segments", "group": i})
+        for i, group in enumerate(groups)
+    ))
+
+    labels = {}
+    for record in records:
+        labels.update(parse_segment_labels(record["output_text"], len(info["topics"])))
+
+    missing = len(segments) - len(labels.keys() & {s["id"] for s in segments})
+    if missing:
+        print(f"⚠ {hearing} / {model} / {prompt}: {missing} segments without labels, counted as neutral")
+
+    header, rows = reduce_labels(segments, labels, info["topics"], info["speakers"])
+
+    output_path = f"{path}/output/{model}"
+    os.makedirs(output_path, exist_ok=True)
+    write_ground_truth(header, rows, folder=output_path, filename=f"{prompt}_segments")
+
+    print(f"✓ Wrote {len(groups)} segment groups to {output_path}/{prompt}_segments.csv")
+
+
+async def run(cells, base_dir="hearings", max_tokens=6000, concurrency=8, retries=5, backoff=2.0, no_cache=False):
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncOpenAI(max_retries=0) as client:
+        results = await asyncio.gather(
+            *(infer_cell(client, semaphore, cell, base_dir, max_tokens, retries, backoff, no_cache) for cell in cells),
+            return_exceptions=True,
+        )
+
+    return [(cell, r) for cell, r in zip(cells, results) if isinstance(r, BaseException)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Segment-level stance inference")
+
+    parser.add_argument('hearings', nargs='*', help="Hearing folders (default: all)")
+    parser.add_argument('-m', '--models', nargs='+', default=MODELS)
+    parser.add_argument('-p', '--prompts', nargs='+', default=PROMPTS, choices=PROMPTS)
+    parser.add_argument('-t', '--max-tokens', type=int, default=6000, help="Estimated transcript tokens per request")
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-r', '--retries', type=int, default=5)
+    parser.add_argument('-b', '--backoff', type=float, default=2.0, help="Initial backoff in seconds")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, then refresh the cache")
+
+    args = parser.parse_args()
+
+    base_dir = "hearings"
+    hearings = args.hearings or sorted(h for h in os.listdir(base_dir) if os.path.isdir(f"{base_dir}/{h}"))
+
+    cells = [
+        (hearing, model, prompt)
+        for hearing in hearings
+        if os.path.isfile(f"{base_dir}/{hearing}/hearing.json") and os.path.isfile(f"{base_dir}/{hearing}/ground_truth.csv")
+        for model in args.models
+        for prompt in args.prompts
+    ]
+
+    failed = asyncio.run(run(cells, base_dir, args.max_tokens, args.concurrency, args.retries, args.backoff,
+                             args.no_cache))
+
+    for (hearing, model, prompt), error in failed:
+        print(f"⨉ {hearing} / {model} / {prompt} failed: {error}")
+
+    if failed:
+        sys.exit(1)
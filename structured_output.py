@@ -0,0 +1,141 @@
+import argparse
+import csv
+import io
+import json
+import random
+
+from create_prompt import load_hearing
+from output_format import OutputFormatError
+
+STANCES = [-1, 0, 1]
+
+
+def stance_schema(speakers, topics):
+    """
+    JSON schema of a complete stance table: one object per speaker, with a
+    -1, 0 or 1 for every topic. Speakers and topics keep their order in
+    "required", which is the order of the CSV.
+    """
+    row = {
+        "type": "object",
+        "properties": {topic: {"type": "integer", "enum": STANCES} for topic in topics},
+        "required": list(topics),
+        "additionalProperties": False,
+    }
+
+    return {
+        "type": "object",
+        "properties": {speaker: row for speaker in speakers},
+        "required": list(speakers),
+        "additionalProperties": False,
+    }
+
+
+def text_format(speakers, topics, name="stances"):
+    """
+    The `text` parameter of a Responses API request that constrains the
+    output to stance_schema().
+    """
+    return {"format": {"type": "json_schema", "name": name, "schema": stance_schema(speakers, topics), "strict": True}}
+
+
+def schema_of(params):
+    """
+    The stance schema of a request's parameters, or None for a CSV request.
+    """
+    fmt = (params or {}).get("text", {}).get("format", {})
+    return fmt.get("schema") if fmt.get("type") == "json_schema" else None
+
+
+def check_stances(data, schema):
+    """
+    Raise OutputFormatError unless data conforms to a stance_schema().
+    """
+    speakers = schema["required"]
+
+    if not isinstance(data, dict) or set(data) != set(speakers):
+        raise OutputFormatError("the speakers do not match the schema")
+
+    for speaker in speakers:
+        topics = schema["properties"][speaker]["required"]
+        row = data[speaker]
+
+        if not isinstance(row, dict) or set(row) != set(topics):
+            raise OutputFormatError(f"the topics of {speaker!r} do not match the schema")
+
+        invalid = [v for v in row.values() if type(v) is not int or v not in STANCES]
+        if invalid:
+            raise OutputFormatError(f"invalid label {invalid[0]!r} for {speaker!r}")
+
+
+def stances_to_csv(output_text, schema):
+    """
+    Convert a structured output into the CSV table the evaluation reads,
+    with the speakers and topics in the order of the schema.
+    """
+    try:
+        data = json.loads(output_text)
+    except json.JSONDecodeError as e:
+        raise OutputFormatError(f"the output is not JSON ({e})") from None
+
+    check_stances(data, schema)
+
+    speakers = schema["required"]
+    topics = schema["properties"][speakers[0]]["required"] if speakers else []
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["Speaker"] + topics)
+    writer.writerows([speaker] + [data[speaker][topic] for topic in topics] for speaker in speakers)
+    return buffer.getvalue()
+
+
+def structured_table(record):
+    """
+    The CSV table of a structured-output response, from its cache record
+    (see llm_cache.make_record). A response that was cut off or refused, or
+    does not match the schema of the request, raises OutputFormatError.
+    """
+    response = record.get("response") or {}
+
+    status = response.get("status") or "completed"
+    if status != "completed":
+        reason = (response.get("incomplete_details") or {}).get("reason")
+        raise OutputFormatError(f"the response is {status}" + (f" ({reason})" if reason else ""))
+
+    for item in response.get("output") or []:
+        for content in item.get("content") or []:
+            if content.get("type") == "refusal":
+                raise OutputFormatError(f"the model refused: {content.get('refusal', '')[:60]!r}")
+
+    return stances_to_csv(record["output_text"], schema_of(record["params"]))
+
+
+def sample_stances(schema, seed=0):
+    """
+    A random answer that conforms to the schema, as a local stand-in for the API.
+    """
+    rng = random.Random(seed)
+    return json.dumps({
+        speaker: {topic: rng.choice(STANCES) for topic in row["required"]}
+        for speaker, row in schema["properties"].items()
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Print the structured-output schema of a hearing")
+
+    parser.add_argument('folder')
+    parser.add_argument('--stand-in', action='store_true',
+                        help="Print the CSV converted from a random schema-conforming answer instead")
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    hearing = load_hearing(f"hearings/{args.folder}")
+    schema = stance_schema(hearing["speakers"], hearing["topics"])
+
+    if args.stand_in:
+        print(stances_to_csv(sample_stances(schema, args.seed), schema), end="")
+    else:
+        print(json.dumps(text_format(hearing["speakers"], hearing["topics"]), indent=2, ensure_ascii=False))
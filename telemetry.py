@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from create_prompt import estimate_tokens
+
+TELEMETRY = ".cache/telemetry.jsonl"
+
+# USD per million input and output tokens (reasoning tokens are billed as
+# output). Only used for estimates; update them when the prices change.
+PRICES = {
+    "chatgpt-4o-latest": (5.00, 15.00),
+    "o3": (2.00, 8.00),
+}
+
+
+def usage_of(response) -> dict:
+    """
+    Token counts of a Responses API response (zeros when it has no usage).
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "reasoning_tokens": 0}
+
+    input_details = getattr(usage, "input_tokens_details", None)
+    output_details = getattr(usage, "output_tokens_details", None)
+
+    return {
+        "input_tokens": usage.input_tokens,
+        "cached_tokens": getattr(input_details, "cached_tokens", 0) or 0,
+        "output_tokens": usage.output_tokens,
+        "reasoning_tokens": getattr(output_details, "reasoning_tokens", 0) or 0,
+    }
+
+
+def estimate_cost(model: str, usage: dict) -> float | None:
+    prices = PRICES.get(model)
+    if prices is None:
+        return None
+
+    return (usage["input_tokens"] * prices[0] + usage["output_tokens"] * prices[1]) / 1_000_000
+
+
+def make_event(model: str, prompt: str, response=None, tags: dict | None = None, **timings) -> dict:
+    """
+    One telemetry event: the tags (hearing, prompt variant, ...), prompt size,
+    token usage, estimated cost and the given timings, retries or error.
+    """
+    usage = usage_of(response)
+
+    return {
+        "time": time.time(),
+        "model": model,
+        **(tags or {}),
+        "prompt_chars": len(prompt),
+        "prompt_tokens_estimate": estimate_tokens(prompt),
+        **usage,
+        "cost": estimate_cost(model, usage) if response is not None else None,
+        **timings,
+    }
+
+
+def record(event: dict, path: str | None = TELEMETRY):
+    """
+    Append an event as one JSON line. Lines are written in a single call, so
+    concurrent writers do not interleave.
+    """
+    if not path:
+        return
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def load_events(path: str = TELEMETRY) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(events: list[dict], by=("model", "prompt"), percentiles=(50, 90, 99)) -> dict:
+    """
+    Per group: number of calls, cache hits, failures and streams aborted for
+    being off-format (with their mean time to abort), latency and TTFB
+    percentiles of successful API calls, mean token counts and total cost.
+    """
+    groups = {}
+    for event in events:
+        groups.setdefault(tuple(event.get(k) for k in by), []).append(event)
+
+    summary = {}
+    for key, group in sorted(groups.items(), key=lambda item: str(item[0])):
+        calls = [e for e in group if not e.get("cached") and not e.get("error")]
+        row = {
+            "calls": len(calls),
+            "cache_hits": sum(1 for e in group if e.get("cached")),
+            "failures": sum(1 for e in group if e.get("error") and not e.get("aborted")),
+            "aborted": sum(1 for e in group if e.get("aborted")),
+            "retries": sum(e.get("retries", 0) for e in group),
+        }
+
+        aborted = [e["latency"] for e in group if e.get("aborted")]
+        row["time_to_abort"] = float(np.mean(aborted)) if aborted else None
+
+        for metric in ("latency", "ttfb"):
+            values = [e[metric] for e in calls if e.get(metric) is not None]
+            for p in percentiles:
+                row[f"{metric}_p{p}"] = float(np.percentile(values, p)) if values else None
+
+        for tokens in ("input_tokens", "output_tokens", "reasoning_tokens"):
+            row[f"mean_{tokens}"] = float(np.mean([e[tokens] for e in calls])) if calls else None
+
+        row["cost"] = sum(e["cost"] for e in calls if e.get("cost") is not None)
+        summary[" / ".join(str(k) for k in key)] = row
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Summarize LLM call telemetry")
+
+    parser.add_argument('-f', '--file', default=TELEMETRY)
+    parser.add_argument('--by', nargs='+', default=["model", "prompt"], help="Event fields to group by")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    args = parser.parse_args()
+
+    summary = summarize(load_events(args.file), by=args.by)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        fmt = lambda v: "-" if v is None else f"{v:.2f}"
+        print(f"{'group':40} {'calls':>5} {'hits':>5} {'fail':>5} {'abort':>5} {'retry':>5} "
+              f"{'p50 s':>7} {'p90 s':>7} {'p99 s':>7} {'ttfb50':>7} {'in tok':>8} {'out tok':>8} {'reason':>8} {'cost $':>8}")
+        for group, row in summary.items():
+            print(f"{group:40} {row['calls']:5d} {row['cache_hits']:5d} {row['failures']:5d} {row['aborted']:5d} "
+                  f"{row['retries']:5d} {fmt(row['latency_p50']):>7} {fmt(row['latency_p90']):>7} {fmt(row['latency_p99']):>7} "
+                  f"{fmt(row['ttfb_p50']):>7} {fmt(row['mean_input_tokens']):>8} {fmt(row['mean_output_tokens']):>8} "
+                  f"{fmt(row['mean_reasoning_tokens']):>8} {row['cost']:8.2f}")